@@ -0,0 +1,122 @@
+"""Moodle attendance pipeline benchmark.
+
+Compares the extraction on the pages in `fixtures/` against a full
+`html.parser` parse, then drives `Moodle` end to end against a local fake
+Moodle serving the same pages, once with a throwaway session per login and
+once through a shared `MoodlePool`.
+
+    python -m benchmarks.lms_parse [--users 50] [--courses 12] [--rounds 200]
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from aiohttp import ClientSession
+from bs4 import BeautifulSoup
+
+from chronicler import lms
+from chronicler.lms import HTML_PARSER, Moodle, MoodlePool, Report
+
+from .upstream import FIXTURES, FakeMoodle
+
+LOGIN = (FIXTURES / "login.html").read_text()
+ATTENDANCE = (FIXTURES / "attendance.html").read_text()
+
+
+def legacy_login(text: str) -> str | None:
+    soup = BeautifulSoup(text, "html.parser")
+    if tag := soup.select_one("#login > input:nth-child(1)"):
+        return str(tag.get("value"))
+
+
+def legacy_report(text: str, *, name: str) -> Report | None:
+    soup = BeautifulSoup(text, "html.parser")
+    if data := soup.select_one(".attlist > tbody:nth-child(1)"):
+        tds = data.select("td")
+        seq = list(Report.model_fields.keys())[1:]
+        pack = {}
+        for item, i in zip(seq, range(1, len(tds), 2)):
+            pack[item] = tds[i].text
+        pack["name"] = name
+        return Report(**pack)
+
+
+def login(text: str) -> str | None:
+    soup = BeautifulSoup(text, HTML_PARSER, parse_only=lms.LOGIN_FORM)
+    if tag := soup.select_one("#login > input:nth-child(1)"):
+        return str(tag.get("value"))
+
+
+def rate(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return rounds / (time.perf_counter() - start)
+
+
+def bench_parse(rounds: int):
+    assert legacy_login(LOGIN) == login(LOGIN)
+    assert legacy_report(ATTENDANCE, name="x") == Report.parse(ATTENDANCE, name="x")
+    print(f"parser: {HTML_PARSER}")
+    for label, old, new in (
+        ("login", lambda: legacy_login(LOGIN), lambda: login(LOGIN)),
+        (
+            "report",
+            lambda: legacy_report(ATTENDANCE, name="x"),
+            lambda: Report.parse(ATTENDANCE, name="x"),
+        ),
+    ):
+        before, after = rate(old, rounds), rate(new, rounds)
+        print(f"{label:>8}: {before:8.1f}/s -> {after:8.1f}/s ({after / before:.1f}x)")
+
+
+async def per_request(prn: str) -> list[Report]:
+    async with ClientSession() as session:
+        moodle = await Moodle.init(prn=prn, session=session)
+        return await moodle.get_all_reports()
+
+
+async def pooled(pool: MoodlePool, prn: str) -> list[Report]:
+    async with pool.session() as session:
+        moodle = await Moodle.init(prn=prn, session=session, limiter=pool.limiter)
+        return await moodle.get_all_reports()
+
+
+async def bench_pipeline(users: int, courses: int, latency: float):
+    fake = FakeMoodle(courses, latency)
+    lms.BASE_URL = await fake.start()
+    pool = MoodlePool()
+    try:
+        for label, run in (
+            ("per-request", lambda prn: per_request(prn)),
+            ("pooled", lambda prn: pooled(pool, prn)),
+        ):
+            fake.requests = 0
+            fake.peers.clear()
+            start = time.perf_counter()
+            results = await asyncio.gather(*(run(str(i)) for i in range(users)))
+            elapsed = time.perf_counter() - start
+            assert all(len(r) == courses for r in results)
+            print(
+                f"{label:>12}: {users / elapsed:7.1f} logins/s, "
+                f"{fake.requests} requests over {len(fake.peers)} connections"
+            )
+    finally:
+        await pool.close()
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+    bench_parse(args.rounds)
+    asyncio.run(bench_pipeline(args.users, args.courses, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Load benchmark for the app against local upstream simulators.
+
+Starts a fake `report.php` and a fake Moodle (see `upstream.py`) on their
+own event loop, points `core.BASE_URL` and `lms.BASE_URL` at them, and
+drives the app in-process with concurrent requests per scenario:
+
+    table  POST /      filtered timetable over `--days` days
+    fc     POST /fc    free classrooms, whole day and at a time
+    home   GET  /      index page with the type catalogue
+    lms    POST /lms   attendance report for `--users` students
+
+Each scenario reports latency percentiles, throughput, error count and
+the upstream requests it caused; the process' peak RSS (which includes
+the simulators) is reported at the end. `--json` prints the same numbers
+as one JSON object, to keep alongside a commit.
+
+    python -m benchmarks.load [--requests 200] [--concurrency 16] [--rooms 60]
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable
+
+from .upstream import TYPES, FakeMoodle, FakeReport, serve_in_thread
+
+SCENARIOS = ["table", "fc", "home", "lms"]
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def drive(
+    call: Callable[[int], Awaitable[int]], requests: int, concurrency: int
+) -> dict[str, Any]:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            status = await call(i)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    report = FakeReport(rooms=args.rooms, per_room=args.per_room, latency=args.latency)
+    moodle = FakeMoodle(courses=args.courses, latency=args.latency)
+    report_url, moodle_url = serve_in_thread(report, moodle)
+
+    # configuration is read when the app module is imported
+    os.environ.setdefault("CHRONICLER_RATE_LIMIT", "0")
+    os.environ.setdefault("CHRONICLER_PREFETCH_DAYS", "0")
+    os.environ.setdefault(
+        "CHRONICLER_TYPE_CODES", ",".join(f"{c}={t}" for c, t in TYPES.items())
+    )
+    from litestar.testing import AsyncTestClient
+    from chronicler import core, lms
+    from chronicler.app import app
+
+    core.BASE_URL = report_url / "report.php"
+    lms.BASE_URL = moodle_url
+
+    today = date.today()
+    last = today + timedelta(days=args.days - 1)
+    filters = [
+        {"Lecture": ["BCA"], "Practical": ["Lab"]},
+        {"Lecture": ["Course 1\\d"], "Tutorial": []},
+        {"Exam": [], "Seminar": ["Prof\\. [A-C]"]},
+    ]
+    rooms = ["All", "101 Lab", "003", "Nowhere"]
+
+    results: dict[str, Any] = {"scenarios": {}}
+    async with AsyncTestClient(app=app, base_url="http://127.0.0.1") as client:
+
+        async def table(i: int) -> int:
+            payload = {
+                "start": today.isoformat(),
+                "end": last.isoformat(),
+                "types": filters[i % len(filters)],
+            }
+            return (await client.post("/", json=payload)).status_code
+
+        async def fc(i: int) -> int:
+            payload: dict[str, Any] = {
+                "date": (today + timedelta(days=i % args.days)).isoformat(),
+                "room": rooms[i % len(rooms)],
+            }
+            if i % 2:
+                payload["time"] = f"{9 + i % 10:02}:15"
+            return (await client.post("/fc", json=payload)).status_code
+
+        async def home(i: int) -> int:
+            return (await client.get("/")).status_code
+
+        async def attendance(i: int) -> int:
+            form = {"username": str(i % args.users), "password": "hunter2"}
+            return (await client.post("/lms", data=form)).status_code
+
+        calls = {"table": table, "fc": fc, "home": home, "lms": attendance}
+        for name in args.scenarios:
+            before = report.requests, moodle.requests
+            stats = await drive(calls[name], args.requests, args.concurrency)
+            stats["report_requests"] = report.requests - before[0]
+            stats["moodle_requests"] = moodle.requests - before[1]
+            results["scenarios"][name] = stats
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def show(results: dict[str, Any]):
+    print(
+        f"{'scenario':<8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'errors':>7} {'report':>7} {'moodle':>7}"
+    )
+    for name, s in results["scenarios"].items():
+        print(
+            f"{name:<8} {s['throughput']:9.1f} {s['p50_ms']:9.2f} {s['p95_ms']:9.2f}"
+            f" {s['p99_ms']:9.2f} {s['errors']:7} {s['report_requests']:7}"
+            f" {s['moodle_requests']:7}"
+        )
+    print(f"peak RSS: {results['peak_rss_mb']:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=SCENARIOS)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--rooms", type=int, default=60)
+    parser.add_argument("--per-room", type=int, default=6)
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        show(results)
+
+
+if __name__ == "__main__":
+    main()
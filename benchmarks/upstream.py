@@ -0,0 +1,273 @@
+"""Local stand-ins for the timetable's `report.php` and for Moodle.
+
+Both count the requests they answer so a benchmark can report how much
+upstream traffic a run caused.
+"""
+
+from __future__ import annotations
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import random
+import threading
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from aiohttp import web
+from yarl import URL
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+HEADER = [
+    "Brief description",
+    "Area",
+    "Room",
+    "Start time",
+    "End time",
+    "Duration",
+    "Full Description",
+    "Type",
+    "Created by",
+    "Confirmation status",
+    "Last updated",
+]
+# MRBS matches `typematch[]` against one-letter type codes
+TYPES = {
+    "A": "Lecture",
+    "B": "Practical",
+    "C": "Tutorial",
+    "D": "Seminar",
+    "E": "Exam",
+    "F": "Guest Lecture",
+}
+PROGRAMMES = ["BCA", "BBA-IT", "MBA-IT", "MSc-CA"]
+
+
+def fmt(dt: datetime) -> str:
+    return dt.strftime("%H:%M:%S - %A %d %B %Y")
+
+
+class Upstream:
+    """An aiohttp app on an ephemeral localhost port, counting what it serves"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.requests = 0
+        self.app = web.Application()
+
+    async def _hit(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def start(self) -> URL:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return URL(f"http://127.0.0.1:{port}/")
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class FakeReport(Upstream):
+    """`report.php` answering CSV reports of `rooms` x `per_room` bookings a day.
+
+    `charset` is sent in the `Content-Type`; the real report.php may send none.
+    """
+
+    def __init__(
+        self,
+        *,
+        rooms: int = 60,
+        per_room: int = 6,
+        latency: float = 0,
+        charset: str | None = "utf-8",
+    ):
+        super().__init__(latency)
+        self.rooms = rooms
+        self.per_room = per_room
+        self.charset = charset
+        self.days_served = 0
+        self.app.router.add_get("/report.php", self.report)
+
+    @lru_cache(maxsize=1024)
+    def day(self, day: date) -> list[list[str]]:
+        rng = random.Random(day.toordinal())
+        updated = fmt(datetime.combine(day - timedelta(days=7), datetime.min.time()))
+        rows: list[list[str]] = []
+        for room in range(self.rooms):
+            name = f"{1 + room // 20}{room % 20:02} Lab" if room % 3 else f"{room:03}"
+            slot = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+            for _ in range(self.per_room):
+                slot += timedelta(minutes=rng.choice((0, 0, 30, 60)))
+                hours = rng.choice((1, 1, 1, 2))
+                end = slot + timedelta(hours=hours)
+                programme = rng.choice(PROGRAMMES)
+                rows.append(
+                    [
+                        f"{programme} SEM {rng.randint(1, 6)} DIV {rng.choice('ABC')}",
+                        "SICSR",
+                        name,
+                        fmt(slot),
+                        fmt(end),
+                        f"{hours} hours",
+                        f"{programme}-{rng.randint(100, 140)} Course {rng.randint(1, 40)}"
+                        f" - Prof. {rng.choice('ABCDEFGHIJ')}",
+                        rng.choice(list(TYPES.values())),
+                        "admin",
+                        "Confirmed",
+                        updated,
+                    ]
+                )
+                slot = end
+        return rows
+
+    def body(self, start: date, end: date, rooms: str, types: frozenset[str]) -> bytes:
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(HEADER)
+        day = start
+        while day <= end:
+            for row in self.day(day):
+                if rooms and rooms.lower() not in row[2].lower():
+                    continue
+                if types and row[7] not in types:
+                    continue
+                writer.writerow(row)
+            day += timedelta(days=1)
+        return out.getvalue().encode()
+
+    async def report(self, request: web.Request):
+        await self._hit()
+        q = request.query
+
+        def day(prefix: str) -> date:
+            return date(
+                int(q[f"{prefix}_year"]),
+                int(q[f"{prefix}_month"]),
+                int(q[f"{prefix}_day"]),
+            )
+
+        types = frozenset(TYPES[c] for c in q.getall("typematch[]", []) if c in TYPES)
+        start, end = day("from"), day("to")
+        self.days_served += (end - start).days + 1
+        body = self.body(start, end, q.get("roommatch", ""), types)
+        etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        content_type = "text/csv"
+        if self.charset:
+            content_type += f"; charset={self.charset}"
+        return web.Response(
+            body=body, headers={"Content-Type": content_type, "ETag": etag}
+        )
+
+
+def course(i: int) -> dict:
+    return {
+        "id": i,
+        "fullname": f"Course {i}",
+        "shortname": f"C{i}",
+        "idnumber": "",
+        "summary": "",
+        "summaryformat": 1,
+        "startdate": 1704067200,
+        "enddate": 1719792000,
+        "visible": True,
+        "showactivitydates": False,
+        "showcompletionconditions": False,
+        "fullnamedisplay": f"Course {i}",
+        "viewurl": "",
+        "courseimage": "",
+        "progress": 0,
+        "hasprogress": False,
+        "isfavourite": False,
+        "hidden": False,
+        "showshortname": False,
+        "coursecategory": "",
+    }
+
+
+def course_state(i: int) -> str:
+    cm = {
+        "id": str(5000 + i),
+        "anchor": "",
+        "name": "Attendance",
+        "visible": True,
+        "sectionid": "1",
+        "sectionnumber": 0,
+        "uservisible": True,
+        "hascmrestrictions": False,
+        "accessvisible": True,
+        "istrackeduser": False,
+    }
+    meta = {
+        "id": str(i),
+        "numsections": 1,
+        "sectionlist": ["1"],
+        "editmode": False,
+        "highlighted": "",
+        "maxsections": "52",
+        "baseurl": "",
+        "statekey": "",
+    }
+    return json.dumps({"course": meta, "section": [], "cm": [cm]})
+
+
+class FakeMoodle(Upstream):
+    """Moodle login, AJAX service and attendance pages, served from `fixtures/`"""
+
+    def __init__(self, courses: int = 12, latency: float = 0):
+        super().__init__(latency)
+        self.courses = courses
+        self.login_page_html = (FIXTURES / "login.html").read_text()
+        self.attendance_html = (FIXTURES / "attendance.html").read_text()
+        self.peers: set[tuple[str, int]] = set()
+        self.app.router.add_get("/login/index.php", self.login_page)
+        self.app.router.add_post("/login/index.php", self.login)
+        self.app.router.add_post("/lib/ajax/service.php", self.service)
+        self.app.router.add_get("/mod/attendance/view.php", self.attendance)
+
+    async def _seen(self, request: web.Request):
+        if request.transport is not None:
+            self.peers.add(request.transport.get_extra_info("peername"))
+        await self._hit()
+
+    async def login_page(self, request: web.Request):
+        await self._seen(request)
+        return web.Response(text=self.login_page_html, content_type="text/html")
+
+    async def login(self, request: web.Request):
+        await self._seen(request)
+        return web.Response(text='M.cfg = {"sesskey":"Xq7Lk2pA9z"};')
+
+    async def service(self, request: web.Request):
+        await self._seen(request)
+        body = await request.json()
+        if body[0]["methodname"] == "core_courseformat_get_state":
+            return web.json_response(
+                [
+                    {"error": False, "data": course_state(call["args"]["courseid"])}
+                    for call in body
+                ]
+            )
+        courses = [course(i) for i in range(self.courses)]
+        return web.json_response([{"error": False, "data": {"courses": courses}}])
+
+    async def attendance(self, request: web.Request):
+        await self._seen(request)
+        return web.Response(text=self.attendance_html, content_type="text/html")
+
+
+def serve_in_thread(*upstreams: Upstream) -> list[URL]:
+    """Starts upstreams on their own loop, so they never wait on the code under test"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return [
+        asyncio.run_coroutine_threadsafe(u.start(), loop).result() for u in upstreams
+    ]
@@ -1,13 +1,16 @@
-import re
+import hashlib
+import logging
+import os
 import time
-from datetime import datetime, date, time as dtime
+from datetime import datetime, date, time as dtime, timedelta
 from pathlib import Path
-from typing import Annotated, Any
-from aiohttp import ClientSession
+from functools import cache
+from typing import TYPE_CHECKING, Annotated, Any, AsyncIterator
+from aiohttp import ClientSession, ClientTimeout
 from pydantic import BaseModel, Field
 from litestar import Controller, Request, Response, get, post
 from litestar.datastructures import State
-from litestar.response import Template
+from litestar.response import Stream, Template
 from litestar import Litestar
 from litestar.contrib.jinja import JinjaTemplateEngine
 from litestar.template.config import TemplateConfig
@@ -15,17 +18,83 @@ from litestar.config.cors import CORSConfig
 from litestar.config.allowed_hosts import AllowedHostsConfig
 from litestar.static_files import create_static_files_router
 from litestar.enums import RequestEncodingType
-from litestar.params import Body
+from litestar.params import Body, Parameter
 from litestar.middleware.session.server_side import ServerSideSessionConfig
 from litestar.middleware.rate_limit import RateLimitConfig
+from litestar.stores.base import Store
 from litestar.stores.file import FileStore
-from litestar.exceptions import HTTPException
-
-from .core import TimetableClient, Entry
-from .lms import Moodle
+from litestar.stores.memory import MemoryStore
+from litestar.exceptions import HTTPException, ValidationException
+from litestar.serialization import encode_json
+from litestar.status_codes import HTTP_503_SERVICE_UNAVAILABLE
+
+from .breaker import CircuitBreaker, UpstreamUnavailable
+from .core import (
+    CATALOGUE_SPAN,
+    TimetableClient,
+    Entry,
+    Record,
+    as_date,
+    days_between,
+    diff,
+)
+from .db import TimetableStore
+from .shared import LitestarSegmentStore
+from .lms import AuthFailException, MoodleCache, MoodlePool, Report
+from .prefetch import Prefetcher
+from .responses import ResponseCache, respond
+from .filters import FilterError, FilterKey, compile_filters
+from .metrics import render as render_metrics, stage, upstream_trace
+from .planner import Planner, parse_type_codes
+from .rooms import RoomIndex
+from .search import SearchIndex
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+from .sessions import CountingStore, WriteBehindStore
 
 APP_START_TIME = datetime.now()
 
+log = logging.getLogger(__name__)
+
+CACHE_TTL = float(os.getenv("CHRONICLER_CACHE_TTL", 300))
+CACHE_SIZE = int(os.getenv("CHRONICLER_CACHE_SIZE", 256))
+CACHE_DAYS = int(os.getenv("CHRONICLER_CACHE_DAYS", 366))
+DATABASE_URL = os.getenv("CHRONICLER_DATABASE_URL", "")
+# file or a redis:// URL to share between workers; memory only serves one process
+SHARED_CACHE = os.getenv("CHRONICLER_SHARED_CACHE", "")
+TIMETABLE_CACHE_DIR = Path("timetable_cache")
+TIMETABLE_LOCK_DIR = Path("timetable_locks")
+SHARED_CACHE_RETENTION = float(os.getenv("CHRONICLER_SHARED_CACHE_RETENTION", 86400))
+SHARED_LOCK_TIMEOUT = float(os.getenv("CHRONICLER_SHARED_LOCK_TIMEOUT", 30))
+RESPONSE_CACHE_SIZE = int(os.getenv("CHRONICLER_RESPONSE_CACHE_SIZE", 1024))
+TRUSTED_PARSE = os.getenv("CHRONICLER_TRUSTED_PARSE", "1") == "1"
+PREFETCH_INTERVAL = float(os.getenv("CHRONICLER_PREFETCH_INTERVAL", 240))
+PREFETCH_DAYS = int(os.getenv("CHRONICLER_PREFETCH_DAYS", 7))
+PREFETCH_JITTER = float(os.getenv("CHRONICLER_PREFETCH_JITTER", 30))
+MOODLE_CONNECTIONS = int(os.getenv("CHRONICLER_MOODLE_CONNECTIONS", 100))
+MOODLE_CONCURRENCY = int(os.getenv("CHRONICLER_MOODLE_CONCURRENCY", 16))
+MOODLE_REPORT_TTL = float(os.getenv("CHRONICLER_MOODLE_REPORT_TTL", 300))
+MOODLE_SESSION_TTL = float(os.getenv("CHRONICLER_MOODLE_SESSION_TTL", 1800))
+MOODLE_TERM_TTL = float(os.getenv("CHRONICLER_MOODLE_TERM_TTL", 7 * 86400))
+MOODLE_CACHE_SIZE = int(os.getenv("CHRONICLER_MOODLE_CACHE_SIZE", 1024))
+RATE_LIMIT = int(os.getenv("CHRONICLER_RATE_LIMIT", 30))  # per minute, 0 disables
+SESSION_SWEEP_INTERVAL = float(os.getenv("CHRONICLER_SESSION_SWEEP_INTERVAL", 600))
+SESSION_STORE = os.getenv("CHRONICLER_SESSION_STORE", "file")  # file, sqlite or memory
+SESSION_DB = os.getenv("CHRONICLER_SESSION_DB", "sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.getenv("CHRONICLER_SESSION_FLUSH_INTERVAL", 5))
+# report.php filters types by code, e.g. "A=Lecture,B=Practical"
+TYPE_CODES = parse_type_codes(os.getenv("CHRONICLER_TYPE_CODES", ""))
+PUSHDOWN_RATIO = float(os.getenv("CHRONICLER_PUSHDOWN_RATIO", 0.5))  # 0 disables
+COALESCE_WINDOW = float(os.getenv("CHRONICLER_COALESCE_WINDOW", 0.005))  # 0 disables
+COALESCE_SPAN = int(os.getenv("CHRONICLER_COALESCE_SPAN", 62))  # days
+UPSTREAM_TIMEOUT = float(os.getenv("CHRONICLER_UPSTREAM_TIMEOUT", 20))
+BREAKER_THRESHOLD = int(os.getenv("CHRONICLER_BREAKER_THRESHOLD", 5))  # 0 disables
+BREAKER_COOLDOWN = float(os.getenv("CHRONICLER_BREAKER_COOLDOWN", 30))
+# searches are limited to a window around today, so they can't pull in arbitrary years
+SEARCH_DAYS = int(os.getenv("CHRONICLER_SEARCH_DAYS", 120))  # ahead
+SEARCH_PAST_DAYS = int(os.getenv("CHRONICLER_SEARCH_PAST_DAYS", 30))
+
 
 class Payload(BaseModel):
     start: date | None = None
@@ -44,6 +113,36 @@ class Payload(BaseModel):
 
 class TimetableResponse(BaseModel):
     entries: dict[date, list[dict[str, Any]]]
+    fields: list[str] = Entry.dump_fields
+
+
+class SyncPayload(Payload):
+    versions: dict[date, str] = {}  # day: version the client already has
+
+
+def sync_version(fingerprint: str, filters: FilterKey) -> str:
+    """A day's version as a client filtering it by `filters` sees it"""
+    tag = hashlib.blake2b(repr(filters).encode(), digest_size=6).hexdigest()
+    return f"{fingerprint}.{tag}"
+
+
+class DayChanges(BaseModel):
+    version: str
+    entries: list[dict[str, Any]] | None = None  # the whole day, if it can't be diffed
+    added: list[dict[str, Any]] = []
+    changed: list[dict[str, Any]] = []
+    removed: list[dict[str, Any]] = []
+
+
+class SyncResponse(BaseModel):
+    days: dict[date, DayChanges]  # only the days that changed
+    time: float
+    fields: list[str] = Entry.dump_fields
+
+
+class SearchResponse(BaseModel):
+    entries: dict[date, list[dict[str, Any]]]
+    total: int  # matches, including any past `limit`
     time: float
     fields: list[str] = Entry.dump_fields
 
@@ -64,7 +163,6 @@ class FreeClassesForm(BaseModel):
 
 
 class FreeClassesPayload(BaseModel):
-    time: float
     entries: dict[str, list[tuple[str, str]]]
 
 
@@ -95,31 +193,137 @@ class MainController(Controller):
         request: Request,
         state: State,
         data: Payload,
-    ) -> TimetableResponse:
+    ) -> Response[bytes]:
         start = time.perf_counter()
         request.set_session(data)
-        entries: dict[date, list[Entry]] = {}
-        items = await state.client.fetch(start=data.get_start(), end=data.get_end())
+        try:
+            matcher = compile_filters(data.types)
+        except FilterError as e:
+            raise ValidationException(detail=str(e))
+        first, last = data.get_start(), data.get_end()
+        planner: Planner = state.planner
+        items = await planner.records(
+            first, last, planner.table(first, last, data.types)
+        )
+
+        def build() -> TimetableResponse:
+            entries: dict[date, list[Record]] = {}
+            with stage("table.filter"):
+                for item in items:  # days with nothing left still get listed
+                    entries.setdefault(item.start.date(), [])
+                for item in matcher.select(items):
+                    entries[item.start.date()].append(item)
+            with stage("table.sort"):
+                for bucket in entries.values():
+                    bucket.sort(key=lambda e: e.start)
+
+            with stage("table.serialize"):
+                response: dict[date, list[dict[str, Any]]] = {}
+                for e, b in sorted(entries.items(), key=lambda t: t[0]):
+                    response[e] = [i.dump() for i in b]
+
+                return TimetableResponse(entries=response)
+
+        key = ("table", first, last, matcher.key, state.client.versions(first, last))
+        return respond(
+            request,
+            state.responses.get_or_build(key, build),
+            age=state.client.age(first, last),
+            elapsed=time.perf_counter() - start,
+        )
+
+    @post("/sync")
+    async def sync_table(self, state: State, data: SyncPayload) -> SyncResponse:
+        """Changes to the timetable since the versions the client sends back"""
+        start = time.perf_counter()
+        try:
+            matcher = compile_filters(data.types)
+        except FilterError as e:
+            raise ValidationException(detail=str(e))
+        first, last = data.get_start(), data.get_end()
+        client: TimetableClient = state.client
+        items = await client.records(first, last)
+
+        def dump(records: list[Record]) -> list[dict[str, Any]]:
+            return [r.dump() for r in sorted(records, key=lambda r: r.start)]
+
+        current: dict[date, list[Record]] = {
+            day: [] for day in days_between(first, last)
+        }
         for item in items:
-            bucket = entries.setdefault(item.start.date(), [])
-            if item.type in data.types:
-                filters = data.types[item.type]
-                if not filters:
-                    bucket.append(item)
-                for filt in filters:
-                    if re.search(filt, item.full_desc):
-                        bucket.append(item)
-                        break
-            elif not data.types:  # if no types are specified, render the whole table
+            if (bucket := current.get(item.start.date())) is not None:
                 bucket.append(item)
-        for bucket in entries.values():
-            bucket.sort(key=lambda e: e.start)
 
-        response: dict[date, list[dict[str, Any]]] = {}
-        for e, b in sorted(entries.items(), key=lambda t: t[0]):
-            response[e] = [i.dump() for i in b]
+        days: dict[date, DayChanges] = {}
+        with stage("sync.diff"):
+            for day, records in current.items():
+                version = sync_version(client.version(day) or "", matcher.key)
+                if (known := data.versions.get(day)) == version:
+                    continue
+                new = matcher.select(records)
+                # a version from other filters can't be diffed against, since
+                # its rows were selected differently
+                old = None
+                if known is not None:
+                    fingerprint = known.rpartition(".")[0]
+                    if sync_version(fingerprint, matcher.key) == known:
+                        old = client.snapshot(day, fingerprint)
+                if old is None:
+                    days[day] = DayChanges(version=version, entries=dump(new))
+                    continue
+                delta = diff(matcher.select(old), new)
+                days[day] = DayChanges(
+                    version=version,
+                    added=dump(delta.added),
+                    changed=dump(delta.changed),
+                    removed=dump(delta.removed),
+                )
+        return SyncResponse(days=days, time=time.perf_counter() - start)
 
-        return TimetableResponse(entries=response, time=time.perf_counter() - start)
+    @get("/search")
+    async def search(
+        self,
+        state: State,
+        q: str = "",
+        room: str = "",
+        type_: Annotated[str, Parameter(query="type")] = "",
+        creator: str = "",
+        first: Annotated[date | None, Parameter(query="from")] = None,
+        last: Annotated[date | None, Parameter(query="to")] = None,
+        start: Annotated[int | None, Parameter(ge=0, le=23)] = None,
+        end: Annotated[int | None, Parameter(ge=0, le=24)] = None,
+        limit: Annotated[int, Parameter(ge=1, le=1000)] = 200,
+    ) -> SearchResponse:
+        """Bookings by words of their description, room, type or creator, and time of day"""
+        began = time.perf_counter()
+        today = datetime.now().date()
+        earliest = today - timedelta(days=SEARCH_PAST_DAYS)
+        latest = today + timedelta(days=SEARCH_DAYS - 1)
+        first = min(max(first or today, earliest), latest)
+        last = min(max(last or latest, first), latest)
+        # makes sure the whole range is cached, and so indexed
+        await state.client.records(first, last)
+        index: SearchIndex[Record] = state.search
+        with stage("search.lookup"):
+            found = list(
+                index.search(
+                    q,
+                    room=room,
+                    type=type_,
+                    creator=creator,
+                    first=first,
+                    last=last,
+                    start=None if start is None else dtime(start),
+                    end=None if end is None or end == 24 else dtime(end),
+                )
+            )
+            found.sort(key=lambda e: e.start)
+        entries: dict[date, list[dict[str, Any]]] = {}
+        for item in found[:limit]:
+            entries.setdefault(item.start.date(), []).append(item.dump())
+        return SearchResponse(
+            entries=entries, total=len(found), time=time.perf_counter() - began
+        )
 
     @get("/about")
     async def about(self) -> Template:
@@ -132,97 +336,187 @@ class MainController(Controller):
     @post("/lms")
     async def render_attendance_report(
         self,
+        state: State,
         data: Annotated[MoodleLogin, Body(media_type=RequestEncodingType.URL_ENCODED)],
     ) -> Template:
         start = time.perf_counter()
-        async with ClientSession() as session:
-            moodle = await Moodle.init(
-                prn=data.username, password=data.password, session=session
-            )
-            reports = await moodle.get_all_reports()
-            return Template(
-                "report.html",
-                context=dict(reports=reports, time=time.perf_counter() - start),
-            )
+        cache: MoodleCache = state.lms
+        reports = await cache.reports(prn=data.username, password=data.password)
+        return Template(
+            "report.html",
+            context=dict(reports=reports, time=time.perf_counter() - start),
+        )
+
+    @post("/lms/stream")
+    async def stream_attendance_report(
+        self,
+        state: State,
+        data: Annotated[MoodleLogin, Body(media_type=RequestEncodingType.URL_ENCODED)],
+    ) -> Stream:
+        """JSON lines: the fields, then one row per course as it arrives, then the time"""
+        cache: MoodleCache = state.lms
+
+        async def lines() -> AsyncIterator[bytes]:
+            start = time.perf_counter()
+            yield encode_json({"fields": Report.get_fields()}) + b"\n"
+            try:
+                async for report in cache.stream(
+                    prn=data.username, password=data.password
+                ):
+                    yield encode_json({"row": report.as_row()}) + b"\n"
+            except AuthFailException:
+                yield encode_json({"error": "Could not login!"}) + b"\n"
+                return
+            except Exception:
+                log.exception("Streaming attendance report failed")
+                yield encode_json({"error": "Could not fetch the report!"}) + b"\n"
+                return
+            yield encode_json({"time": time.perf_counter() - start}) + b"\n"
+
+        return Stream(lines(), media_type="application/x-ndjson")
 
     @post("/fc")
     async def render_free_classrooms(
-        self, state: State, data: FreeClassesForm
-    ) -> FreeClassesPayload:
+        self, request: Request, state: State, data: FreeClassesForm
+    ) -> Response[bytes]:
         start = time.perf_counter()
-        now = data.date or datetime.now()
-        entries: list[Entry] = await state.client.fetch(start=now, end=now)
-        rooms: dict[str, list[Entry]] = {}
-        for entry in entries:
-            bucket = rooms.setdefault(entry.room, [])
-            bucket.append(entry)
-        for bucket in rooms.values():
-            bucket.sort(key=lambda e: e.start)
-
-        free: dict[str, list[tuple[datetime, datetime]]] = {}
-        for room, bucket in rooms.items():
-            if not bucket:
-                continue
-            free_bucket = free.setdefault(room, [])
-            start_hour = bucket[0].start
-            if start_hour.hour != 7:
-                free_bucket.append(
-                    (
-                        datetime.now().replace(
-                            hour=7, minute=30, second=0, microsecond=0
-                        ),
-                        start_hour,
-                    )
-                )
-            for i in range(len(bucket) - 1):
-                entry = bucket[i]
-                next_entry = bucket[i + 1]
-                if entry.end < next_entry.start:
-                    free_bucket.append((entry.end, next_entry.start))
-            last_hour = bucket[-1].end
-            if last_hour.hour != 20:
-                free_bucket.append(
-                    (
-                        last_hour,
-                        datetime.now().replace(
-                            hour=20, minute=30, second=0, microsecond=0
-                        ),
-                    )
-                )
-        sorted_entries: dict[str, list[tuple[str, str]]] = {}
-        for room, bucket in sorted(free.items(), key=lambda t: t[0]):
-            f = "%H:%M"
-            if data.room == "All" or room == int(data.room):
-                new = []
-                for s, e in bucket:
-                    if data.time is None or (s.time() <= data.time <= e.time()):
-                        new.append((s.strftime(f), e.strftime(f)))
-                sorted_entries[room] = new
-
-        return FreeClassesPayload(
-            time=time.perf_counter() - start, entries=sorted_entries
+        day = as_date(data.date or datetime.now())
+        planner: Planner = state.planner
+        if (plan := planner.rooms(day, data.room)) is None:
+            index = await state.client.room_index(day)
+        else:
+            records = await planner.records(day, day, plan)
+            with stage("fc.index"):
+                index = RoomIndex(records)
+
+        def build() -> FreeClassesPayload:
+            if data.room == "All":
+                rooms = index.rooms
+            else:
+                rooms = [data.room] if data.room in index else []
+
+            sorted_entries: dict[str, list[tuple[str, str]]] = {}
+            with stage("fc.lookup"):
+                for room in rooms:
+                    if data.time is None:
+                        sorted_entries[room] = index.windows(room)
+                    else:
+                        window = index.window_at(room, data.time)
+                        sorted_entries[room] = [window] if window else []
+
+            return FreeClassesPayload(entries=sorted_entries)
+
+        key = ("fc", day, data.room, data.time, state.client.versions(day, day))
+        return respond(
+            request,
+            state.responses.get_or_build(key, build),
+            age=state.client.age(day, day),
+            elapsed=time.perf_counter() - start,
         )
 
     @get("/fc")
     async def free_classrooms(self, state: State) -> Template:
-        return Template("fc.html", context={"classes": await state.client.get_rooms()})
+        return Template("fc.html", context={"classes": await state.client.getrooms()})
+
+    @get("/metrics", media_type="text/plain; version=0.0.4")
+    async def metrics(self) -> str:
+        return render_metrics()
 
     @get("/stats")
-    async def statistics(self) -> Statistics:
+    async def statistics(self, request: Request) -> Statistics:
         uptime = datetime.now() - APP_START_TIME
-        sessions = len(list(Path("./session_data").glob("*")))
-        return Statistics(uptime=uptime.total_seconds(), sessions=sessions)
+        sessions: CountingStore = request.app.stores.get("sessions")  # type: ignore[assignment]
+        return Statistics(uptime=uptime.total_seconds(), sessions=sessions.count)
 
 
 async def init_http_session(app: Litestar):
-    session = ClientSession()
+    session = ClientSession(
+        timeout=ClientTimeout(total=UPSTREAM_TIMEOUT),
+        trace_configs=[upstream_trace("timetable")],
+    )
     app.state.http = session
-    app.state.client = TimetableClient(session=session)
+    app.state.store = None
+    if SHARED_CACHE:
+        if SHARED_CACHE == "memory":
+            log.warning("CHRONICLER_SHARED_CACHE=memory is not shared between workers")
+        app.state.store = LitestarSegmentStore(
+            app.stores.get("timetable"),
+            redis=shared_redis() if is_redis_url(SHARED_CACHE) else None,
+            lock_dir=str(TIMETABLE_LOCK_DIR) if SHARED_CACHE == "file" else None,
+            retention=SHARED_CACHE_RETENTION,
+            lock_timeout=SHARED_LOCK_TIMEOUT,
+        )
+    elif DATABASE_URL:
+        app.state.store = TimetableStore(DATABASE_URL)
+    if app.state.store is not None:
+        try:
+            await app.state.store.init()
+        except Exception:
+            # the store only saves work; the timetable can still be served without it
+            log.exception("Could not open the timetable store, running without it")
+            app.state.store = None
+    app.state.search = SearchIndex[Record]()
+    app.state.client = TimetableClient(
+        session=session,
+        cache_ttl=CACHE_TTL,
+        cache_size=CACHE_SIZE,
+        cache_days=CACHE_DAYS,
+        trusted=TRUSTED_PARSE,
+        store=app.state.store,
+        coalesce_window=COALESCE_WINDOW,
+        coalesce_span=COALESCE_SPAN,
+        index=app.state.search,
+        breaker=CircuitBreaker(
+            "timetable", threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN
+        ),
+    )
+    app.state.planner = Planner(
+        app.state.client, type_codes=TYPE_CODES, ratio=PUSHDOWN_RATIO
+    )
+    today = datetime.now().date()
+    await app.state.client.warm(today, today + CATALOGUE_SPAN)
+    app.state.responses = ResponseCache(ttl=CACHE_TTL, maxsize=RESPONSE_CACHE_SIZE)
+    app.state.prefetcher = Prefetcher(
+        app.state.client,
+        interval=PREFETCH_INTERVAL,
+        days=PREFETCH_DAYS,
+        jitter=PREFETCH_JITTER,
+    )
+    if PREFETCH_DAYS > 0:
+        app.state.prefetcher.start()
+    app.state.moodle = MoodlePool(limit=MOODLE_CONNECTIONS, per_host=MOODLE_CONCURRENCY)
+    app.state.lms = MoodleCache(
+        app.state.moodle,
+        report_ttl=MOODLE_REPORT_TTL,
+        session_ttl=MOODLE_SESSION_TTL,
+        term_ttl=MOODLE_TERM_TTL,
+        maxsize=MOODLE_CACHE_SIZE,
+    )
 
 
 async def close_http_session(app: Litestar):
-    if (session := app.state.http) and not session.closed:
+    # startup may have failed part way, so any of these can be missing
+    state = app.state
+    if (prefetcher := state.get("prefetcher")) is not None:
+        await prefetcher.stop()
+    if (client := state.get("client")) is not None:
+        await client.flush()
+    if (store := state.get("store")) is not None:
+        await store.close()
+    if (session := state.get("http")) is not None and not session.closed:
         await session.close()
+    if (moodle := state.get("moodle")) is not None:
+        await moodle.close()
+
+
+async def open_session_store(app: Litestar):
+    sessions: CountingStore = app.stores.get("sessions")  # type: ignore[assignment]
+    await sessions.open()
+
+
+async def close_session_store(app: Litestar):
+    sessions: CountingStore = app.stores.get("sessions")  # type: ignore[assignment]
+    await sessions.close()
 
 
 def http_error_handler(request: Request, exc: HTTPException) -> Template | Response:
@@ -234,6 +528,24 @@ def http_error_handler(request: Request, exc: HTTPException) -> Template | Respo
     )
 
 
+def filter_error_handler(request: Request, exc: FilterError) -> Template | Response:
+    # filters that only turn out to be too slow once they run against the timetable
+    return http_error_handler(request, ValidationException(detail=str(exc)))
+
+
+def upstream_error_handler(
+    request: Request, exc: UpstreamUnavailable
+) -> Template | Response:
+    log.warning("Timetable upstream unavailable: %s", exc)
+    return http_error_handler(
+        request,
+        HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The timetable server isn't responding, try again in a bit",
+        ),
+    )
+
+
 cors_config = CORSConfig(
     allow_origins=[
         "https://chr.zeffo.me",
@@ -253,7 +565,40 @@ allowed_hosts = AllowedHostsConfig(
     ]
 )
 
-rate_limit_conf = RateLimitConfig(("minute", 30))
+rate_limit_conf = RateLimitConfig(("minute", RATE_LIMIT))
+
+
+def is_redis_url(url: str) -> bool:
+    return url.startswith(("redis://", "rediss://", "unix://"))
+
+
+@cache
+def shared_redis() -> "Redis":
+    """One client for the timetable store and its locks"""
+    from redis.asyncio import Redis
+
+    return Redis.from_url(SHARED_CACHE)
+
+
+def timetable_store() -> Store:
+    if SHARED_CACHE == "file":
+        return FileStore(path=TIMETABLE_CACHE_DIR)
+    if is_redis_url(SHARED_CACHE):
+        from litestar.stores.redis import RedisStore
+
+        return RedisStore(
+            shared_redis(), namespace="chronicler", handle_client_shutdown=True
+        )
+    return MemoryStore()
+
+
+def session_store() -> Store:
+    if SESSION_STORE == "sqlite":
+        return WriteBehindStore(SESSION_DB, flush_interval=SESSION_FLUSH_INTERVAL)
+    if SESSION_STORE == "memory":
+        return MemoryStore()
+    return FileStore(path=Path("session_data"))
+
 
 app = Litestar(
     route_handlers=[
@@ -264,14 +609,21 @@ app = Litestar(
         directory=Path("templates"),
         engine=JinjaTemplateEngine,
     ),
-    on_startup=[init_http_session],
-    on_shutdown=[close_http_session],
+    on_startup=[init_http_session, open_session_store],
+    on_shutdown=[close_http_session, close_session_store],
     cors_config=cors_config,
     allowed_hosts=allowed_hosts,
     middleware=[
         ServerSideSessionConfig(renew_on_access=True).middleware,
-        rate_limit_conf.middleware,
+        *([rate_limit_conf.middleware] if RATE_LIMIT > 0 else []),
     ],
-    stores={"sessions": FileStore(path=Path("session_data"))},
-    exception_handlers={HTTPException: http_error_handler},
+    stores={
+        "sessions": CountingStore(session_store(), interval=SESSION_SWEEP_INTERVAL),
+        "timetable": timetable_store(),
+    },
+    exception_handlers={
+        HTTPException: http_error_handler,
+        FilterError: filter_error_handler,
+        UpstreamUnavailable: upstream_error_handler,
+    },
 )
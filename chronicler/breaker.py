@@ -0,0 +1,85 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, TypeVar
+from aiohttp import ClientError
+
+from .metrics import CIRCUIT_REJECTIONS
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UpstreamUnavailable(Exception): ...
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after `threshold` consecutive failures.
+
+    While open, calls fail straight away. After `cooldown` seconds one call
+    is let through as a probe (half-open); it closes the circuit if it
+    succeeds and opens it for another `cooldown` if it doesn't.
+    """
+
+    def __init__(self, name: str, *, threshold: int = 5, cooldown: float = 30):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def _allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def _succeeded(self):
+        if self._opened_at is not None:
+            log.info("%s is back, closing its circuit", self.name)
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def _failed(self):
+        self.failures += 1
+        self._probing = False
+        if self.threshold <= 0:  # disabled, never opens
+            return
+        if self._opened_at is not None or self.failures >= self.threshold:
+            if self._opened_at is None:
+                log.warning(
+                    "%s failed %d times in a row, opening its circuit",
+                    self.name,
+                    self.failures,
+                )
+            self._opened_at = time.monotonic()
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        if not self._allow():
+            CIRCUIT_REJECTIONS.inc(self.name)
+            raise UpstreamUnavailable(f"{self.name} is unavailable")
+        try:
+            result = await fn()
+        except (ClientError, asyncio.TimeoutError) as e:
+            self._failed()
+            raise UpstreamUnavailable(f"{self.name} failed: {e!r}") from e
+        except BaseException:
+            self._probing = False  # an abandoned probe says nothing either way
+            raise
+        self._succeeded()
+        return result
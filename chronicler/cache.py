@@ -0,0 +1,118 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, NamedTuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Cached(NamedTuple, Generic[V]):
+    value: V
+    age: float  # seconds since the value was set, had it been set with the default ttl
+    expired: bool
+
+
+class TTLCache(Generic[K, V]):
+    """LRU mapping whose items expire `ttl` seconds after they were set.
+
+    Expired items stay around for another `stale_for` seconds (or until
+    evicted or replaced) for `get_stale` to fall back on. `on_evict` is
+    called with every item that is dropped other than by `pop`, `clear`
+    or being replaced.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        maxsize: int,
+        stale_for: float = 0,
+        on_evict: Callable[[K, V], None] | None = None,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale_for = stale_for
+        self.on_evict = on_evict
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def _drop(self, key: K, value: V):
+        del self._data[key]
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key: K) -> V | None:
+        if (cached := self.get_stale(key)) is None or cached.expired:
+            return None
+        return cached.value
+
+    def get_stale(self, key: K) -> Cached[V] | None:
+        if (item := self._data.get(key)) is None:
+            return None
+        expires, value = item
+        now = time.monotonic()
+        if expires + self.stale_for < now:
+            self._drop(key, value)
+            return None
+        self._data.move_to_end(key)
+        return Cached(value, max(0.0, self.ttl - (expires - now)), expires < now)
+
+    def set(self, key: K, value: V, *, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            old, (_, evicted) = next(iter(self._data.items()))
+            self._drop(old, evicted)
+
+    def pop(self, key: K) -> V | None:
+        if (item := self._data.pop(key, None)) is None:
+            return None
+        return item[1]
+
+    def expire(self):
+        """Drops every item past its expiry and `stale_for`"""
+        now = time.monotonic()
+        for key, (expires, value) in list(self._data.items()):
+            if expires + self.stale_for < now:
+                self._drop(key, value)
+
+    def clear(self):
+        self._data.clear()
+
+
+class SingleFlight(Generic[K, V]):
+    """Collapses concurrent calls for the same key into one in-flight task.
+
+    The task is shielded from its callers, so a cancelled request does not
+    abort a fetch other waiters (or the cache) still depend on.
+    """
+
+    def __init__(self):
+        self._calls: dict[K, asyncio.Task[V]] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._calls
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        return await asyncio.shield(self.start(key, fn))
+
+    def start(self, key: K, fn: Callable[[], Awaitable[V]]) -> asyncio.Task[V]:
+        """Starts the call for a key unless one is in flight, without waiting for it"""
+        if (task := self._calls.get(key)) is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    def _done(self, key: K, task: asyncio.Task[V]):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so abandoned failures aren't logged
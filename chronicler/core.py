@@ -1,11 +1,39 @@
-from aiohttp import ClientSession
+import asyncio
+import calendar
+import codecs
+from collections import Counter
+from aiohttp import ClientResponse, ClientSession
 from yarl import URL
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from html import escape
 from io import StringIO
 from pydantic import BaseModel, Field, BeforeValidator
 import csv
+import hashlib
+import logging
+import sys
+import time
+from urllib.parse import urlencode
 
-from typing import Annotated, Any, ClassVar
+from typing import (
+    Annotated,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ClassVar,
+    Iterable,
+    NamedTuple,
+)
+
+from .breaker import CircuitBreaker, UpstreamUnavailable
+from .cache import SingleFlight, TTLCache
+from .metrics import STAGE_SECONDS, UPSTREAM_COALESCED, cache_lookup, stage
+from .rooms import RoomIndex
+from .search import SearchIndex
+
+log = logging.getLogger(__name__)
 
 
 BASE_URL = URL("http://time-table.sicsr.ac.in/report.php")
@@ -21,10 +49,62 @@ def td_conv(raw: str) -> timedelta:
     return timedelta(**{unit: float(val)})
 
 
+MONTHS = {name: i for i, name in enumerate(calendar.month_name) if name}
+
+
+@lru_cache(maxsize=4096)
+def fast_dt_conv(raw: str) -> datetime:
+    """`dt_conv` without strptime, memoized since a report repeats a handful of
+    slots over a handful of days"""
+    try:
+        clock, _, day = raw.partition(" - ")
+        hour, minute, second = clock.split(":")
+        _, dd, month, year = day.split()
+        return datetime(
+            int(year), MONTHS[month], int(dd), int(hour), int(minute), int(second)
+        )
+    except (ValueError, KeyError):
+        return dt_conv(raw)
+
+
+fast_td_conv = lru_cache(maxsize=256)(td_conv)
+
+
+def as_date(value: date) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def days_between(start: date, end: date) -> list[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def contiguous_runs(days: list[date]) -> list[tuple[date, date]]:
+    """Merges sorted days into as few inclusive (start, end) ranges as possible"""
+    runs: list[tuple[date, date]] = []
+    for day in days:
+        if runs and (day - runs[-1][1]).days == 1:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
 def fmtdt(dt: datetime):
     return dt.strftime("%H:%M %d/%m")
 
 
+def dump_booking(item: Any) -> dict[str, Any]:
+    """The JSON row of an `Entry` or a `Record`, with the keys in `Entry.dump_fields`"""
+    start, end = item.start, item.end
+    return {
+        "start": f"{start.hour:02}:{start.minute:02}",
+        "end": f"{end.hour:02}:{end.minute:02}",
+        "class": item.full_desc,
+        "room": item.room,
+        "duration": item.duration.seconds // 60,
+    }
+
+
 DateTime = Annotated[datetime, BeforeValidator(dt_conv)]
 
 
@@ -43,20 +123,39 @@ class Entry(BaseModel):
     status: str = Field(validation_alias="Confirmation status")
     last_updated: DateTime = Field(validation_alias="Last updated")
 
+    @classmethod
+    def from_row(cls, row: dict[str, str]) -> "Entry":
+        """Builds an entry from a trusted upstream row without per-field validation"""
+        try:
+            return cls.model_construct(
+                brief_desc=row["Brief description"],
+                area=row["Area"],
+                room=row["Room"],
+                start=fast_dt_conv(row["Start time"]),
+                end=fast_dt_conv(row["End time"]),
+                duration=fast_td_conv(row["Duration"]),
+                full_desc=row["Full Description"],
+                type=row["Type"],
+                creator=row["Created by"],
+                status=row["Confirmation status"],
+                last_updated=fast_dt_conv(row["Last updated"]),
+            )
+        except (KeyError, ValueError, TypeError):
+            # let the validated path report what is actually wrong with the row
+            return cls.model_validate(row)
+
     def url(self) -> str:
-        return f'<a href="/search?room={self.room}&start={self.start.hour}&end={self.end.hour}</a>'
+        # /search takes whole hours and a window ending at `end`, so round the
+        # end up to keep the booking itself inside the window
+        end = self.end.hour + bool(self.end.minute or self.end.second)
+        if self.end.date() > self.start.date():
+            end = 24
+        end = max(end, self.start.hour + 1)
+        query = urlencode({"room": self.room, "start": self.start.hour, "end": end})
+        return f'<a href="/search?{escape(query)}">{escape(self.room)}</a>'
 
     def dump(self) -> dict[str, Any]:
-        def fmt(d: datetime) -> str:
-            return d.strftime("%H:%M")
-
-        return {
-            "start": fmt(self.start),
-            "end": fmt(self.end),
-            "class": self.full_desc,
-            "room": self.room,
-            "duration": self.duration.seconds // 60,
-        }
+        return dump_booking(self)
 
     dump_fields: ClassVar[list[str]] = [
         "start",
@@ -70,6 +169,66 @@ class Entry(BaseModel):
         return f"{fmtdt(self.start)} - {fmtdt(self.end)}: {self.full_desc} ({self.duration}) - {self.status}"
 
 
+_shared: dict[Any, Any] = {}
+
+
+def share(value: Any) -> Any:
+    """Returns a canonical instance of an immutable value so repeats cost one pointer"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if len(_shared) > 65536:
+        _shared.clear()
+    return _shared.setdefault(value, value)
+
+
+class Record:
+    """Compact, slotted form of an `Entry` used for cached data.
+
+    Attribute names match `Entry`, so filtering and bucketing code can use
+    either; a full `Entry` is only built when one is needed.
+    """
+
+    __slots__ = tuple(Entry.model_fields)
+
+    brief_desc: str
+    area: str
+    room: str
+    start: datetime
+    end: datetime
+    duration: timedelta
+    full_desc: str
+    type: str
+    creator: str
+    status: str
+    last_updated: datetime
+
+    def __init__(self, entry: Any):
+        """`entry` is an `Entry` or anything else with its attributes, like a database row"""
+        for name in self.__slots__:
+            setattr(self, name, share(getattr(entry, name)))
+
+    @classmethod
+    def fromtuple(cls, values: tuple[Any, ...]) -> "Record":
+        record = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(record, name, share(value))
+        return record
+
+    def astuple(self) -> tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def entry(self) -> Entry:
+        return Entry.model_construct(
+            **{name: getattr(self, name) for name in self.__slots__}
+        )
+
+    def dump(self) -> dict[str, Any]:
+        return dump_booking(self)
+
+    def __str__(self):
+        return str(self.entry())
+
+
 def build_url(
     start: datetime,
     end: datetime,
@@ -201,30 +360,457 @@ async def fetch(
     return map(lambda row: Entry.model_validate(row), reader)
 
 
+async def _iter_records(
+    resp: ClientResponse, *, digest: "hashlib._Hash | None" = None
+) -> AsyncIterator[list[str]]:
+    """Decodes and parses CSV records as chunks of the body arrive.
+
+    Lines are collected until their quotes balance, so quoted fields that
+    span lines are handed to the csv module as a single record. Each raw
+    chunk also goes into `digest`, if one is given.
+    """
+    # get_encoding() would need the whole body to guess a missing charset
+    decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")()
+    tail = ""
+    record: list[str] = []
+    quotes = 0
+    waited = parsed = 0.0
+
+    def feed(lines: list[str]):
+        nonlocal quotes
+        for line in lines:
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                row = next(csv.reader(record), [])
+                record.clear()
+                quotes = 0
+                if row:
+                    yield row
+
+    mark = time.perf_counter()
+    async for chunk in resp.content.iter_any():
+        now = time.perf_counter()
+        waited += now - mark
+        if digest is not None:
+            digest.update(chunk)
+        *lines, tail = (tail + decoder.decode(chunk)).split("\n")
+        rows = list(feed([line + "\n" for line in lines]))
+        parsed += time.perf_counter() - now
+        for row in rows:
+            yield row
+        mark = time.perf_counter()
+    now = time.perf_counter()
+    waited += now - mark
+    tail += decoder.decode(b"", final=True)
+    rows = list(feed([tail] if tail else []))
+    parsed += time.perf_counter() - now
+    STAGE_SECONDS.observe(waited, "report.download")
+    STAGE_SECONDS.observe(parsed, "report.csv")
+    for row in rows:
+        yield row
+
+
+async def stream_report(
+    start: date,
+    end: date,
+    *,
+    areamatch: str = "",
+    roommatch: str = "",
+    typematch: list[str] = [],
+    namematch: str = "",
+    descrmatch: str = "",
+    creatormatch: str = "",
+    match_confirmed: int = 2,
+    session: ClientSession,
+) -> AsyncIterator[dict[str, str]]:
+    url = build_url(
+        start,
+        end,
+        areamatch=areamatch,
+        roommatch=roommatch,
+        typematch=typematch,
+        namematch=namematch,
+        descrmatch=descrmatch,
+        creatormatch=creatormatch,
+        match_confirmed=match_confirmed,
+    )
+    started = time.perf_counter()
+    async with session.get(url) as resp:
+        STAGE_SECONDS.observe(time.perf_counter() - started, "report.upstream")
+        resp.raise_for_status()
+        header: list[str] | None = None
+        async for row in _iter_records(resp):
+            if header is None:
+                header = row
+            else:
+                yield dict(zip(header, row))
+
+
+async def stream(
+    start: date,
+    end: date,
+    *,
+    areamatch: str = "",
+    roommatch: str = "",
+    typematch: list[str] = [],
+    namematch: str = "",
+    descrmatch: str = "",
+    creatormatch: str = "",
+    match_confirmed: int = 2,
+    session: ClientSession,
+    trusted: bool = False,
+) -> AsyncIterator[Entry]:
+    parse = Entry.from_row if trusted else Entry.model_validate
+    parsed = 0.0
+    async for row in stream_report(
+        start,
+        end,
+        areamatch=areamatch,
+        roommatch=roommatch,
+        typematch=typematch,
+        namematch=namematch,
+        descrmatch=descrmatch,
+        creatormatch=creatormatch,
+        match_confirmed=match_confirmed,
+        session=session,
+    ):
+        started = time.perf_counter()
+        entry = parse(row)
+        parsed += time.perf_counter() - started
+        yield entry
+    STAGE_SECONDS.observe(parsed, "report.parse")
+
+
+class Validators(NamedTuple):
+    digest: str
+    etag: str | None
+    last_modified: str | None
+
+
+class Snapshot(NamedTuple):
+    segments: dict[date, list[Record]]  # every day of the range, even if empty
+    validators: Validators
+
+
+async def download(
+    start: date,
+    end: date,
+    *,
+    session: ClientSession,
+    validators: Validators | None = None,
+    trusted: bool = False,
+) -> Snapshot | None:
+    """Fetches the report for a range into day segments, or None if the upstream answers 304.
+
+    The body is hashed and parsed row by row as it streams in, so only the
+    bookings are held; callers drop them if the digest turns out unchanged.
+    """
+    headers: dict[str, str] = {}
+    if validators and validators.etag:
+        headers["If-None-Match"] = validators.etag
+    if validators and validators.last_modified:
+        headers["If-Modified-Since"] = validators.last_modified
+    started = time.perf_counter()
+    async with session.get(build_url(start, end), headers=headers) as resp:
+        STAGE_SECONDS.observe(time.perf_counter() - started, "report.upstream")
+        if resp.status == 304:
+            return None
+        resp.raise_for_status()
+        parse = Entry.from_row if trusted else Entry.model_validate
+        digest = hashlib.blake2b(digest_size=16)
+        segments: dict[date, list[Record]] = {d: [] for d in days_between(start, end)}
+        header: list[str] | None = None
+        parsed = 0.0
+        async for row in _iter_records(resp, digest=digest):
+            if header is None:
+                header = row
+                continue
+            mark = time.perf_counter()
+            entry = parse(dict(zip(header, row)))
+            if (bucket := segments.get(entry.start.date())) is not None:
+                bucket.append(Record(entry))
+            parsed += time.perf_counter() - mark
+        STAGE_SECONDS.observe(parsed, "report.parse")
+        return Snapshot(
+            segments,
+            Validators(
+                digest.hexdigest(),
+                resp.headers.get("ETag"),
+                resp.headers.get("Last-Modified"),
+            ),
+        )
+
+
+def fingerprint(segment: list[Record]) -> str:
+    """Stable digest of a day's content, comparable across processes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for record in segment:
+        digest.update("\x1f".join(map(str, record.astuple())).encode())
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+Identity = tuple[str, datetime, datetime, str]
+
+
+def identity(record: Record) -> Identity:
+    """What makes two versions of a booking the same booking"""
+    return record.room, record.start, record.end, record.full_desc
+
+
+class Delta(NamedTuple):
+    added: list[Record]
+    changed: list[Record]
+    removed: list[Record]
+
+
+def diff(old: Iterable[Record], new: Iterable[Record]) -> Delta:
+    """Changes between two versions of a day, matching bookings by `identity`"""
+    before = {identity(r): r for r in old}
+    after = {identity(r): r for r in new}
+    return Delta(
+        added=[r for key, r in after.items() if key not in before],
+        changed=[
+            r
+            for key, r in after.items()
+            if key in before and before[key].astuple() != r.astuple()
+        ],
+        removed=[r for key, r in before.items() if key not in after],
+    )
+
+
+class StoredDay:
+    __slots__ = ("fetched_at", "fingerprint", "records")
+
+    def __init__(self, fetched_at: float, fingerprint: str, records: list[Record]):
+        self.fetched_at = fetched_at
+        self.fingerprint = fingerprint
+        self.records = records
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class SegmentStore:
+    """Somewhere outside this process to share parsed day segments through.
+
+    Stores that can lock across processes override `acquire`/`release`, so
+    only one worker fetches a missing day while the others wait for it.
+    """
+
+    lock_timeout: float = 0
+
+    async def init(self): ...
+
+    async def close(self): ...
+
+    async def load(
+        self, start: date, end: date, *, max_age: float | None = None
+    ) -> dict[date, StoredDay]:
+        raise NotImplementedError
+
+    async def save(self, segments: dict[date, tuple[str, list[Record]]]):
+        """Writes (fingerprint, records) per day"""
+        raise NotImplementedError
+
+    async def acquire(self, day: date) -> bool:
+        return True
+
+    async def release(self, day: date): ...
+
+
+QueryKey = tuple[date, date, str, str, tuple[str, ...], str, str, str, int]
+Segments = dict[date, list[Record]]
+
+CATALOGUE_SPAN = timedelta(weeks=4)
+# earlier versions of each day kept to sync clients from, and for how long
+SNAPSHOTS_KEPT = 4
+SNAPSHOT_TTL = 86400
+# how long expired days and queries are still served while they can't be refreshed
+STALE_FOR = 86400
+
+
+class RangeDispatcher:
+    """Merges range fetches that overlap or touch into one upstream request.
+
+    While a fetch is in flight, new ranges are held for `window` seconds
+    and fetched together with whatever else arrived, as one union no
+    longer than `max_span` days; each caller gets back just its own days.
+    With nothing in flight a range goes out immediately, so a lone request
+    never waits on the window.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[date, date], Awaitable[Segments]],
+        *,
+        window: float = 0.005,
+        max_span: int = 62,
+    ):
+        self._fetch = fetch
+        self.window = window
+        self.max_span = max_span
+        self._queued: list[tuple[date, date, asyncio.Future[Segments]]] = []
+        self._flush: asyncio.TimerHandle | None = None
+        self._inflight: set[asyncio.Task[None]] = set()
+
+    async def fetch(self, start: date, end: date) -> Segments:
+        future: asyncio.Future[Segments] = asyncio.get_running_loop().create_future()
+        self._queued.append((start, end, future))
+        if self.window <= 0 or not (self._inflight or self._flush):
+            self._dispatch()
+        elif self._flush is None:
+            self._flush = asyncio.get_running_loop().call_later(
+                self.window, self._dispatch
+            )
+        return await future
+
+    def _dispatch(self):
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        queued, self._queued = self._queued, []
+        for group in self._merge(queued):
+            task = asyncio.ensure_future(self._run(group))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _merge(
+        self, queued: list[tuple[date, date, asyncio.Future[Segments]]]
+    ) -> list[list[tuple[date, date, asyncio.Future[Segments]]]]:
+        groups: list[list[tuple[date, date, asyncio.Future[Segments]]]] = []
+        first = last = date.min
+        for item in sorted(queued, key=lambda q: q[0]):
+            start, end, _ = item
+            if (
+                groups
+                and start <= last + timedelta(days=1)
+                and (max(end, last) - first).days < self.max_span
+            ):
+                groups[-1].append(item)
+                last = max(end, last)
+            else:
+                groups.append([item])
+                first, last = start, end
+        return groups
+
+    async def _run(self, group: list[tuple[date, date, asyncio.Future[Segments]]]):
+        start = min(q[0] for q in group)
+        end = max(q[1] for q in group)
+        UPSTREAM_COALESCED.inc("timetable", amount=len(group) - 1)
+        try:
+            segments = await self._fetch(start, end)
+        except BaseException as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        for first, last, future in group:
+            if not future.done():
+                future.set_result(
+                    {day: segments[day] for day in days_between(first, last)}
+                )
+
+
 class TimetableClient:
-    def __init__(self, session: ClientSession):
+    def __init__(
+        self,
+        session: ClientSession,
+        *,
+        cache_ttl: float = 300,
+        cache_size: int = 256,
+        cache_days: int = 366,
+        trusted: bool = True,
+        store: SegmentStore | None = None,
+        coalesce_window: float = 0.005,
+        coalesce_span: int = 62,
+        breaker: CircuitBreaker | None = None,
+        index: SearchIndex[Record] | None = None,
+    ):
         self.session = session
+        self.trusted = trusted
+        self.store = store
+        self.index = index
+        self.breaker = breaker or CircuitBreaker("timetable")
+        self._background: set[asyncio.Task[None]] = set()
+        self._catalogued_at = 0.0
+        self._catalogue_refresh: asyncio.Task[None] | None = None
         self._types: set[str] = set()
         self.rooms: set[str] = set()
+        # bookings per type and per room over the catalogue span
+        self.type_counts: Counter[str] = Counter()
+        self.room_counts: Counter[str] = Counter()
+        self._cache: TTLCache[QueryKey, list[Record]] = TTLCache(
+            ttl=cache_ttl, maxsize=cache_size, stale_for=STALE_FOR
+        )
+        self._inflight: SingleFlight[QueryKey, list[Record]] = SingleFlight()
+        self._days: TTLCache[date, list[Record]] = TTLCache(
+            ttl=cache_ttl,
+            maxsize=cache_days,
+            stale_for=STALE_FOR,
+            on_evict=self._forget_day,
+        )
+        self._pending_days: dict[date, asyncio.Task[Segments]] = {}
+        self._dispatcher = RangeDispatcher(
+            self._download_run, window=coalesce_window, max_span=coalesce_span
+        )
+        self._room_indexes: TTLCache[date, RoomIndex] = TTLCache(
+            ttl=cache_ttl, maxsize=cache_days
+        )
+        self._generation = 0
+        self._versions: dict[date, int] = {}
+        self._fingerprints: dict[date, str] = {}
+        self._snapshots: TTLCache[date, dict[str, list[Record]]] = TTLCache(
+            ttl=SNAPSHOT_TTL, maxsize=cache_days
+        )
+        # kept as long as the snapshots, since they describe the same reports
+        self._validators: TTLCache[tuple[date, date], Validators] = TTLCache(
+            ttl=SNAPSHOT_TTL, maxsize=cache_size
+        )
 
     async def get_types(self):
-        if not self._types:
-            start = datetime.now()
-            end = start + timedelta(weeks=4)
-            self._types = {e.type for e in await self.fetch(start, end)}
+        await self._catalogues()
         items = list(self._types)
         items.sort()
         return items
 
     async def getrooms(self):
-        if not self.rooms:
-            start = datetime.now()
-            end = start + timedelta(weeks=4)
-            self.rooms = {e.room for e in await self.fetch(start, end)}
+        await self._catalogues()
         rooms = list(self.rooms)
         rooms.sort()
         return rooms
 
+    async def _catalogues(self):
+        """Loads the catalogues once, then refreshes them in the background as they age"""
+        if not self._catalogued_at:
+            try:
+                await self.refresh_catalogues()
+            except UpstreamUnavailable:
+                log.warning("Timetable is unavailable, serving empty catalogues")
+        elif time.monotonic() - self._catalogued_at > self._days.ttl and (
+            self._catalogue_refresh is None or self._catalogue_refresh.done()
+        ):
+            self._catalogue_refresh = asyncio.ensure_future(self._refresh_catalogues())
+
+    async def _refresh_catalogues(self):
+        try:
+            await self.refresh_catalogues()
+        except Exception:
+            log.exception("Could not refresh the type and room catalogues")
+
+    async def refresh_catalogues(self):
+        start = datetime.now().date()
+        records = await self.records(start, start + CATALOGUE_SPAN)
+        self.type_counts = Counter(r.type for r in records)
+        self.room_counts = Counter(r.room for r in records)
+        self._types = set(self.type_counts)
+        self.rooms = set(self.room_counts)
+        self._catalogued_at = time.monotonic()
+
     async def fetch(
         self,
         start: datetime,
@@ -238,18 +824,451 @@ class TimetableClient:
         creatormatch: str = "",
         match_confirmed: int = 2,
     ) -> list[Entry]:
-        # TODO: add caching here
-        return list(
-            await fetch(
+        records = await self.fetch_records(
+            start,
+            end,
+            areamatch=areamatch,
+            roommatch=roommatch,
+            typematch=typematch,
+            namematch=namematch,
+            descrmatch=descrmatch,
+            creatormatch=creatormatch,
+            match_confirmed=match_confirmed,
+        )
+        return [r.entry() for r in records]
+
+    async def fetch_records(
+        self,
+        start: date,
+        end: date,
+        *,
+        areamatch: str = "",
+        roommatch: str = "",
+        typematch: list[str] = [],
+        namematch: str = "",
+        descrmatch: str = "",
+        creatormatch: str = "",
+        match_confirmed: int = 2,
+    ) -> list[Record]:
+        """Like `fetch`, but returns the cached compact records"""
+        if not (
+            areamatch
+            or roommatch
+            or typematch
+            or namematch
+            or descrmatch
+            or creatormatch
+            or match_confirmed != 2
+        ):
+            return await self.records(as_date(start), as_date(end))
+
+        # the upstream only looks at the day, month and year of the range
+        key: QueryKey = (
+            as_date(start),
+            as_date(end),
+            areamatch,
+            roommatch,
+            tuple(sorted(typematch)),
+            namematch,
+            descrmatch,
+            creatormatch,
+            match_confirmed,
+        )
+        cached = self._cache.get_stale(key)
+        cache_lookup("query", cached is not None and not cached.expired)
+
+        async def _collect() -> list[Record]:
+            return [
+                Record(entry)
+                async for entry in stream(
+                    start,
+                    end,
+                    areamatch=areamatch,
+                    roommatch=roommatch,
+                    typematch=typematch,
+                    namematch=namematch,
+                    descrmatch=descrmatch,
+                    creatormatch=creatormatch,
+                    match_confirmed=match_confirmed,
+                    session=self.session,
+                    trusted=self.trusted,
+                )
+            ]
+
+        async def _fetch() -> list[Record]:
+            records = await self.breaker.call(_collect)
+            self._cache.set(key, records)
+            return records
+
+        if cached is not None:
+            if cached.expired:
+                # serve what we have; the refresh replaces it for later queries
+                self._inflight.start(key, _fetch)
+            return list(cached.value)
+        return list(await self._inflight.do(key, _fetch))
+
+    async def records(self, start: date, end: date) -> list[Record]:
+        """Answers an unfiltered range from per-day segments, fetching only the missing days.
+
+        Expired segments are still served, and refreshed in the background.
+        """
+        days = days_between(start, end)
+        found: Segments = {}
+        waiting: set[asyncio.Task[Segments]] = set()
+        missing: list[date] = []
+        stale: list[date] = []
+        for day in days:
+            cached = self._days.get_stale(day)
+            cache_lookup("day", cached is not None and not cached.expired)
+            if cached is not None:
+                found[day] = cached.value
+                if cached.expired and day not in self._pending_days:
+                    stale.append(day)
+            elif (task := self._pending_days.get(day)) is not None:
+                waiting.add(task)
+            else:
+                missing.append(day)
+
+        for run_start, run_end in contiguous_runs(stale):
+            self._schedule_segments(run_start, run_end)
+        for run_start, run_end in contiguous_runs(missing):
+            waiting.add(self._schedule_segments(run_start, run_end))
+
+        for segments in await asyncio.gather(*map(asyncio.shield, waiting)):
+            found.update(segments)
+
+        records: list[Record] = []
+        for day in days:
+            records.extend(found.get(day, []))
+        return records
+
+    def missing_days(self, start: date, end: date) -> list[date]:
+        """Days of a range that are neither cached (even stale) nor being fetched"""
+        return [
+            day
+            for day in days_between(start, end)
+            if self._days.get_stale(day) is None and day not in self._pending_days
+        ]
+
+    def age(self, start: date, end: date) -> float:
+        """Seconds since the oldest cached day of a range was fetched"""
+        ages = [
+            cached.age
+            for day in days_between(start, end)
+            if (cached := self._days.get_stale(day)) is not None
+        ]
+        return max(ages, default=0.0)
+
+    def versions(self, start: date, end: date) -> tuple[int, ...]:
+        """Version of each day's segment; changes whenever a day is stored again"""
+        return tuple(self._versions.get(day, 0) for day in days_between(start, end))
+
+    def version(self, day: date) -> str | None:
+        """Content hash of a day's current segment, stable across workers"""
+        return self._fingerprints.get(day)
+
+    def snapshot(self, day: date, version: str) -> list[Record] | None:
+        """A day's segment as it was at `version`, if that is still kept"""
+        if (snapshots := self._snapshots.get(day)) is None:
+            return None
+        return snapshots.get(version)
+
+    async def room_index(self, day: date) -> RoomIndex:
+        index = self._room_indexes.get(day)
+        cache_lookup("room_index", index is not None)
+        if index is None:
+            records = await self.records(day, day)
+            with stage("fc.index"):
+                index = RoomIndex(records)
+            # don't keep an index that a refresh in flight is about to replace
+            if day not in self._pending_days:
+                self._room_indexes.set(day, index)
+        return index
+
+    async def refresh(
+        self,
+        start: date,
+        end: date,
+        *,
+        incremental: bool = True,
+        max_age: float = 0,
+    ) -> Segments:
+        """Refetches a range of days, replacing cached segments once the new data is in.
+
+        In incremental mode the upstream is asked conditionally and an
+        unchanged report is not parsed again. Days another worker put in the
+        store less than `max_age` seconds ago are taken from there instead.
+        """
+        return await asyncio.shield(
+            self._schedule_segments(
+                start, end, incremental=incremental, max_age=max_age
+            )
+        )
+
+    def _schedule_segments(
+        self,
+        start: date,
+        end: date,
+        *,
+        incremental: bool = False,
+        max_age: float = 0,
+    ) -> asyncio.Task[Segments]:
+        if incremental:
+            task = asyncio.ensure_future(
+                self._refresh_segments(start, end, max_age=max_age)
+            )
+        else:
+            task = asyncio.ensure_future(self._fetch_segments(start, end))
+        run = days_between(start, end)
+        for day in run:
+            self._pending_days[day] = task
+        task.add_done_callback(lambda t: self._segments_done(t, run))
+        return task
+
+    async def _fetch_segments(self, start: date, end: date) -> Segments:
+        days = days_between(start, end)
+        loaded = await self._load_stored(days, max_age=self._days.ttl + STALE_FOR)
+        segments = {d: s for d, s in loaded.items() if self._days.get(d) is not None}
+        # days the store holds past their TTL are fetched again, but still
+        # served if the upstream is down
+        fallback = {d: s for d, s in loaded.items() if d not in segments}
+        missing = [day for day in days if day not in segments]
+        others: list[date] = []
+        locked: list[date] = []
+        if self.store is not None and missing:
+            locked = [day for day in missing if await self.store.acquire(day)]
+            others = [day for day in missing if day not in locked]
+            missing = locked
+
+        try:
+            fetched = await self._fetch_runs(missing, segments, fallback)
+        except BaseException:
+            self._persist({}, release=locked)
+            raise
+        self._persist(fetched, release=locked)
+        if others:
+            # another worker is fetching these; give it a chance to share them.
+            # Our own days go first, since it may be waiting on them in turn
+            segments.update(await self._await_stored(others))
+            late = [day for day in others if day not in segments]
+            self._persist(await self._fetch_runs(late, segments, fallback))
+        return segments
+
+    async def _fetch_runs(
+        self, days: list[date], segments: Segments, fallback: Segments
+    ) -> Segments:
+        """Downloads days into `segments`, returning what was actually fetched"""
+        fetched: Segments = {}
+        for run_start, run_end in contiguous_runs(days):
+            try:
+                fetched.update(await self._dispatcher.fetch(run_start, run_end))
+            except UpstreamUnavailable:
+                run = days_between(run_start, run_end)
+                if not all(day in fallback for day in run):
+                    raise
+                segments.update((day, fallback[day]) for day in run)
+        for day, segment in fetched.items():
+            segments[day] = self._store_segment(day, segment)
+        return fetched
+
+    async def _download_run(self, start: date, end: date) -> Segments:
+        async def _collect() -> Segments:
+            run: Segments = {day: [] for day in days_between(start, end)}
+            async for entry in stream(
+                start, end, session=self.session, trusted=self.trusted
+            ):
+                if (bucket := run.get(entry.start.date())) is not None:
+                    bucket.append(Record(entry))
+            return run
+
+        return await self.breaker.call(_collect)
+
+    async def _load_stored(
+        self, days: list[date], *, max_age: float | None = None
+    ) -> Segments:
+        if self.store is None or not days:
+            return {}
+        if max_age is None:
+            max_age = self._days.ttl
+        try:
+            stored = await self.store.load(days[0], days[-1], max_age=max_age)
+        except Exception:
+            log.exception("Could not read days from the timetable store")
+            return {}
+        return {
+            day: self._store_segment(day, found.records, ttl=self._days.ttl - found.age)
+            for day, found in stored.items()
+            if day in days
+        }
+
+    async def _await_stored(
+        self, days: list[date], *, max_age: float | None = None
+    ) -> Segments:
+        assert self.store is not None
+        deadline = time.monotonic() + self.store.lock_timeout
+        found: Segments = {}
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            waiting = [d for d in days if d not in found]
+            found.update(await self._load_stored(waiting, max_age=max_age))
+            if len(found) == len(days):
+                break
+        return found
+
+    async def _refresh_segments(
+        self, start: date, end: date, *, max_age: float = 0
+    ) -> Segments:
+        days = days_between(start, end)
+        segments: Segments = {}
+        if max_age > 0:
+            segments = await self._load_stored(days, max_age=max_age)
+        missing = [day for day in days if day not in segments]
+        others: list[date] = []
+        locked: list[date] = []
+        if self.store is not None and missing:
+            locked = [day for day in missing if await self.store.acquire(day)]
+            others = [day for day in missing if day not in locked]
+            missing = locked
+
+        try:
+            refreshed = await self._refresh_runs(missing)
+        except BaseException:
+            self._persist({}, release=locked)
+            raise
+        segments.update(refreshed)
+        self._persist(refreshed, release=locked)
+        if others:
+            # another worker is refreshing these right now, so whatever it
+            # saves will be younger than its lock
+            assert self.store is not None
+            wait_age = max(max_age, self.store.lock_timeout)
+            segments.update(await self._await_stored(others, max_age=wait_age))
+            late = await self._refresh_runs([d for d in others if d not in segments])
+            segments.update(late)
+            self._persist(late)
+        return segments
+
+    async def _refresh_runs(self, days: list[date]) -> Segments:
+        refreshed: Segments = {}
+        for run_start, run_end in contiguous_runs(days):
+            refreshed.update(await self._refresh_run(run_start, run_end))
+        return refreshed
+
+    async def _refresh_run(self, start: date, end: date) -> Segments:
+        cached: dict[date, list[Record] | None] = {}
+        for day in days_between(start, end):
+            # a stale day can still be revalidated, and is renewed if unchanged
+            found = self._days.get_stale(day)
+            cached[day] = None if found is None else found.value
+        known = self._validators.get((start, end))
+        if None in cached.values():
+            known = None  # a partial cache can't be revalidated as a whole
+        snapshot = await self.breaker.call(
+            lambda: download(
                 start,
                 end,
-                areamatch=areamatch,
-                roommatch=roommatch,
-                typematch=typematch,
-                namematch=namematch,
-                descrmatch=descrmatch,
-                creatormatch=creatormatch,
-                match_confirmed=match_confirmed,
                 session=self.session,
+                validators=known,
+                trusted=self.trusted,
             )
         )
+        if snapshot is None or (known and snapshot.validators.digest == known.digest):
+            segments: Segments = {}
+            for day, segment in cached.items():
+                assert segment is not None
+                segments[day] = self._store_segment(day, segment)
+            return segments
+
+        self._validators.set((start, end), snapshot.validators)
+        return {
+            day: self._store_segment(day, segment)
+            for day, segment in snapshot.segments.items()
+        }
+
+    async def warm(self, start: date, end: date):
+        """Loads what the store holds for a range into memory.
+
+        Days past their TTL are cached as expired, so they are served stale
+        and refreshed in the background, even if the upstream is down.
+        """
+        if self.store is None:
+            return
+        try:
+            stored = await self.store.load(
+                start, end, max_age=self._days.ttl + STALE_FOR
+            )
+        except Exception:
+            # an unreachable store only means starting cold
+            log.exception("Could not read days from the timetable store")
+            return
+        for day, found in stored.items():
+            self._store_segment(day, found.records, ttl=self._days.ttl - found.age)
+
+    async def flush(self):
+        """Waits for pending store writes"""
+        await asyncio.gather(*self._background)
+
+    def _persist(self, segments: Segments, *, release: list[date] = []):
+        """Writes segments to the store in the background, then releases their locks"""
+        if self.store is None or not (segments or release):
+            return
+        store = self.store
+        rows = {day: (self._fingerprints[day], seg) for day, seg in segments.items()}
+
+        async def _save():
+            try:
+                if rows:
+                    await store.save(rows)
+            except Exception:
+                log.exception("Could not write days to the timetable store")
+            finally:
+                for day in release:
+                    await store.release(day)
+
+        task = asyncio.ensure_future(_save())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _store_segment(
+        self, day: date, segment: list[Record], *, ttl: float | None = None
+    ) -> list[Record]:
+        """Caches a day's segment, invalidating what was derived from it only if it changed"""
+        digest = fingerprint(segment)
+        if self._fingerprints.get(day) == digest and (
+            (current := self._days.get_stale(day)) is not None
+        ):
+            self._days.set(day, current.value, ttl=ttl)  # renews its TTL
+            return current.value
+        self._days.set(day, segment, ttl=ttl)
+        self._fingerprints[day] = digest
+        snapshots = self._snapshots.get(day) or {}
+        snapshots[digest] = segment
+        while len(snapshots) > SNAPSHOTS_KEPT:
+            del snapshots[next(iter(snapshots))]
+        self._snapshots.set(day, snapshots)
+        if self.index is not None:
+            self.index.replace(day, segment)
+        self._room_indexes.pop(day)
+        self._generation += 1
+        self._versions[day] = self._generation
+        return segment
+
+    def _forget_day(self, day: date, segment: list[Record]):
+        """Drops what is derived from a day once the day cache lets go of it"""
+        self._fingerprints.pop(day, None)
+        self._versions.pop(day, None)
+        self._room_indexes.pop(day)
+        if self.index is not None:
+            self.index.remove(day)
+
+    def prune(self):
+        """Lets go of days and queries that have been stale for too long"""
+        self._days.expire()
+        self._cache.expire()
+
+    def _segments_done(self, task: asyncio.Task[Segments], run: list[date]):
+        for day in run:
+            if self._pending_days.get(day) is task:
+                del self._pending_days[day]
+        if not task.cancelled():
+            task.exception()
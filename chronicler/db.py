@@ -0,0 +1,137 @@
+from __future__ import annotations
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import Index, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from .core import Record, SegmentStore, StoredDay
+
+# dialects with INSERT ... ON CONFLICT
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class Base(DeclarativeBase): ...
+
+
+class StoredEntry(Base):
+    __tablename__ = "entries"
+    __table_args__ = (Index("ix_entries_day_room_type", "day", "room", "type"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    day: Mapped[date]
+    brief_desc: Mapped[str]
+    area: Mapped[str]
+    room: Mapped[str]
+    start: Mapped[datetime]
+    end: Mapped[datetime]
+    duration: Mapped[timedelta]
+    full_desc: Mapped[str]
+    type: Mapped[str]
+    creator: Mapped[str]
+    status: Mapped[str]
+    last_updated: Mapped[datetime]
+
+
+class StoredSegment(Base):
+    __tablename__ = "segments"
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    fetched_at: Mapped[float]
+    fingerprint: Mapped[str]
+
+
+class TimetableStore(SegmentStore):
+    """Parsed day segments persisted through SQLAlchemy, shared by every worker"""
+
+    def __init__(self, url: str):
+        self.engine = create_async_engine(url)
+
+    async def init(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    async def load(
+        self, start: date, end: date, *, max_age: float | None = None
+    ) -> dict[date, StoredDay]:
+        query = select(StoredSegment).where(StoredSegment.day.between(start, end))
+        if max_age is not None:
+            query = query.where(StoredSegment.fetched_at >= time.time() - max_age)
+        async with self.engine.connect() as conn:
+            days = {
+                row.day: StoredDay(row.fetched_at, row.fingerprint, [])
+                for row in await conn.execute(query)
+            }
+            if not days:
+                return {}
+            columns = [getattr(StoredEntry, name) for name in Record.__slots__]
+            rows = await conn.execute(
+                select(StoredEntry.day, *columns)
+                .where(StoredEntry.day.in_(days))
+                .order_by(StoredEntry.id)
+            )
+            for row in rows:
+                days[row.day].records.append(Record(row))
+        return days
+
+    async def save(self, segments: dict[date, tuple[str, list[Record]]]):
+        """Writes (fingerprint, records) per day; unchanged days only get a new timestamp"""
+        now = time.time()
+        async with self.engine.begin() as conn:
+            rows = await conn.execute(
+                select(StoredSegment.day, StoredSegment.fingerprint).where(
+                    StoredSegment.day.in_(segments)
+                )
+            )
+            current = {day: fingerprint for day, fingerprint in rows}
+            for day, (fingerprint, records) in segments.items():
+                if current.get(day) == fingerprint:
+                    await conn.execute(
+                        update(StoredSegment)
+                        .where(StoredSegment.day == day)
+                        .values(fetched_at=now)
+                    )
+                    continue
+                await self._replace(conn, day, fingerprint, records, now)
+
+    async def _replace(
+        self,
+        conn: AsyncConnection,
+        day: date,
+        fingerprint: str,
+        records: list[Record],
+        now: float,
+    ):
+        # writing the segment row first locks the day, so workers saving the
+        # same day take turns instead of interleaving their entries
+        await self._write_segment(conn, day, fingerprint, now)
+        await conn.execute(delete(StoredEntry).where(StoredEntry.day == day))
+        if records:
+            await conn.execute(
+                StoredEntry.__table__.insert(),
+                [
+                    {"day": day, **dict(zip(Record.__slots__, r.astuple()))}
+                    for r in records
+                ],
+            )
+
+    async def _write_segment(
+        self, conn: AsyncConnection, day: date, fingerprint: str, now: float
+    ):
+        values = {"day": day, "fetched_at": now, "fingerprint": fingerprint}
+        if (upsert := UPSERTS.get(self.engine.dialect.name)) is None:
+            await conn.execute(delete(StoredSegment).where(StoredSegment.day == day))
+            await conn.execute(insert(StoredSegment).values(values))
+            return
+        await conn.execute(
+            upsert(StoredSegment)
+            .values(values)
+            .on_conflict_do_update(
+                index_elements=[StoredSegment.day],
+                set_={"fetched_at": now, "fingerprint": fingerprint},
+            )
+        )
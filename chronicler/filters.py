@@ -0,0 +1,129 @@
+from __future__ import annotations
+import re
+import time
+from functools import lru_cache
+from typing import Iterable, Protocol, TypeVar
+import regex
+
+MAX_FILTERS = 32
+MAX_PATTERN_LENGTH = 256
+# seconds one type's filters may spend on one description before they are rejected;
+# a hard limit, since no static check catches every pattern that backtracks badly
+MATCH_TIMEOUT = 0.05
+MATCH_BUDGET = 1.0  # seconds the searches of one `select` call may add up to
+# a quantified group that itself contains a quantifier, e.g. `(a+)+` or `(\w*\s?)*`,
+# is the usual shape of catastrophic backtracking
+NESTED_QUANTIFIER = re.compile(
+    r"\((?:[^()\\]|\\.)*[*+}](?:[^()\\]|\\.)*\)(?:[*+]|\{\d*,)"
+)
+
+FilterKey = tuple[tuple[str, tuple[str, ...]], ...]
+
+
+class FilterError(ValueError): ...
+
+
+class Filterable(Protocol):
+    type: str
+    full_desc: str
+
+
+T = TypeVar("T", bound=Filterable)
+
+
+def filter_key(types: dict[str, list[str]]) -> FilterKey:
+    return tuple(sorted((t, tuple(filters)) for t, filters in types.items()))
+
+
+def _check(pattern: str) -> regex.Pattern[str]:
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise FilterError(f"Filter is longer than {MAX_PATTERN_LENGTH} characters")
+    if NESTED_QUANTIFIER.search(pattern):
+        raise FilterError(f"Filter {pattern!r} nests quantifiers")
+    try:
+        return regex.compile(pattern)
+    except regex.error as e:
+        raise FilterError(f"Invalid filter {pattern!r}: {e}") from None
+
+
+class Matcher:
+    """A `Payload.types` mapping compiled into one pattern per type.
+
+    Results are memoized per (type, description), since a timetable repeats
+    the same few hundred descriptions across every day. Each search runs
+    under `MATCH_TIMEOUT`, and the searches of one `select` together under
+    `MATCH_BUDGET`; filters that exceed either raise `FilterError`. A
+    timeout also marks the filters as failed for good, since the matcher is
+    cached for its key; running over budget only fails that one call.
+    """
+
+    def __init__(self, key: FilterKey):
+        self.key = key
+        self.error: str | None = None
+        self._spent = 0.0
+        self._patterns: dict[str, regex.Pattern[str] | _Any | None] = {}
+        self._seen: dict[tuple[str, str], bool] = {}
+        for type_, filters in key:
+            if len(filters) > MAX_FILTERS:
+                raise FilterError(f"More than {MAX_FILTERS} filters for {type_!r}")
+            compiled = [_check(f) for f in filters]
+            if not compiled:
+                self._patterns[type_] = None
+                continue
+            try:
+                self._patterns[type_] = regex.compile(
+                    "|".join(f"(?:{p.pattern})" for p in compiled)
+                )
+            except regex.error:
+                # e.g. inline global flags, which are only valid at the start
+                # of a pattern; fall back to checking them one at a time
+                self._patterns[type_] = _Any(compiled)
+
+    def match(self, item: Filterable) -> bool:
+        if self.error is not None:
+            raise FilterError(self.error)
+        if not self._patterns:  # if no types are specified, render the whole table
+            return True
+        if item.type not in self._patterns:
+            return False
+        if (pattern := self._patterns[item.type]) is None:
+            return True
+        key = (item.type, item.full_desc)
+        if (hit := self._seen.get(key)) is None:
+            if len(self._seen) > 8192:
+                self._seen.clear()
+            started = time.perf_counter()
+            try:
+                found = pattern.search(item.full_desc, timeout=MATCH_TIMEOUT)
+            except TimeoutError:
+                self.error = f"Filters for {item.type!r} take too long to match"
+                raise FilterError(self.error) from None
+            self._spent += time.perf_counter() - started
+            if self._spent >= MATCH_BUDGET:
+                raise FilterError(f"Filters for {item.type!r} take too long to match")
+            hit = self._seen[key] = found is not None
+        return hit
+
+    def select(self, items: Iterable[T]) -> list[T]:
+        self._spent = 0.0
+        return [item for item in items if self.match(item)]
+
+
+class _Any:
+    def __init__(self, patterns: list[regex.Pattern[str]]):
+        self.patterns = patterns
+
+    def search(self, string: str, timeout: float | None = None) -> bool | None:
+        return any(p.search(string, timeout=timeout) for p in self.patterns) or None
+
+
+@lru_cache(maxsize=512)
+def _compile(key: FilterKey) -> Matcher:
+    return Matcher(key)
+
+
+def compile_filters(types: dict[str, list[str]]) -> Matcher:
+    matcher = _compile(filter_key(types))
+    if matcher.error is not None:
+        raise FilterError(matcher.error)
+    return matcher
@@ -1,23 +1,88 @@
 from __future__ import annotations
 import asyncio
+import hashlib
+import hmac
+import os
 import re
 import json
-from typing import Any
+import time
+from contextlib import nullcontext
+from importlib.util import find_spec
+from typing import Any, AsyncContextManager, AsyncIterator, NamedTuple
 from pydantic import BaseModel
 from yarl import URL
-from bs4 import BeautifulSoup
-from aiohttp import ClientSession
+from bs4 import BeautifulSoup, SoupStrainer
+from aiohttp import ClientSession, CookieJar, TCPConnector
 from datetime import datetime
 
+from .cache import TTLCache
+from .metrics import cache_lookup, stage, upstream_trace
+
 SESSKEY_REGEX = re.compile(r'"sesskey":"(.+?)"')
 INVALID_LOGIN = re.compile(r"Invalid login")
 
 BASE_URL = URL("https://lms.sicsr.ac.in/")
+# course state lookups sent per `service.php` call
+STATE_BATCH = 10
+
+# lxml is optional; it builds the (strained) trees several times faster
+HTML_PARSER = "lxml" if find_spec("lxml") else "html.parser"
+LOGIN_FORM = SoupStrainer(id="login")
+ATTENDANCE_TABLE = SoupStrainer(class_="attlist")
+
+
+class HostLimiter:
+    """Bounds the requests in flight to each upstream host, across all users"""
+
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def __call__(self, url: URL) -> asyncio.Semaphore:
+        host = url.host or ""
+        if (semaphore := self._semaphores.get(host)) is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        return semaphore
+
+
+class MoodlePool:
+    """App-lifetime connection pool; each login gets its own cookie jar on top of it"""
+
+    def __init__(self, *, limit: int = 100, per_host: int = 16):
+        self.connector = TCPConnector(limit=limit)
+        self.limiter = HostLimiter(per_host)
+        self.trace = upstream_trace("moodle")
+
+    def session(self, cookie_jar: CookieJar | None = None) -> ClientSession:
+        return ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            cookie_jar=CookieJar() if cookie_jar is None else cookie_jar,
+            trace_configs=[self.trace],
+        )
+
+    async def close(self):
+        await self.connector.close()
+
+
+Limiter = HostLimiter | None
+
+
+def _limit(limiter: Limiter, url: URL) -> AsyncContextManager[Any]:
+    return nullcontext() if limiter is None else limiter(url)
 
 
 class AuthFailException(BaseException): ...
 
 
+class SessionExpired(Exception): ...
+
+
+class Attendance(NamedTuple):
+    name: str
+    module: str
+
+
 class Course(BaseModel):
     id: int
     fullname: str
@@ -75,20 +140,37 @@ class CoursePage(BaseModel):
 
 class Moodle:
 
-    def __init__(self, session_key: str, *, session: ClientSession):
+    def __init__(
+        self, session_key: str, *, session: ClientSession, limiter: Limiter = None
+    ):
         self.session_key = session_key
         self.session = session
+        self.limiter = limiter
 
     @classmethod
     async def init(
-        cls, *, prn: str, password: str = "Student@1234", session: ClientSession
+        cls,
+        *,
+        prn: str,
+        password: str = "Student@1234",
+        session: ClientSession,
+        limiter: Limiter = None,
+    ):
+        with stage("lms.login"):
+            return await cls._login(
+                prn=prn, password=password, session=session, limiter=limiter
+            )
+
+    @classmethod
+    async def _login(
+        cls, *, prn: str, password: str, session: ClientSession, limiter: Limiter
     ):
         url = BASE_URL / "login/index.php"
-        async with session.get(url) as resp:
+        async with _limit(limiter, url), session.get(url) as resp:
             text = await resp.text()
 
         def _thread():
-            soup = BeautifulSoup(text, "html.parser")
+            soup = BeautifulSoup(text, HTML_PARSER, parse_only=LOGIN_FORM)
             if tag := soup.select_one("#login > input:nth-child(1)"):
                 token = tag.get("value")
                 data = {
@@ -101,13 +183,16 @@ class Moodle:
                 raise Exception("Could not login!")
 
         data = await asyncio.to_thread(_thread)
-        async with session.post(url, data=data) as resp:
+        async with _limit(limiter, url), session.post(url, data=data) as resp:
             text = await resp.text()
             if (match := SESSKEY_REGEX.search(text)) and not INVALID_LOGIN.search(text):
-                return cls(str(match.group(1)), session=session)
+                return cls(str(match.group(1)), session=session, limiter=limiter)
             raise AuthFailException(f"Could not login PRN {prn}!")
 
     async def get_all_reports(self) -> list[Report]:
+        return await self.get_reports(await self.attendance())
+
+    async def courses(self) -> list[Course]:
         body = [
             {
                 "index": 0,
@@ -131,36 +216,104 @@ class Moodle:
                 "info": "core_course_get_enrolled_courses_by_timeline_classification",
             }
         )
-        async with self.session.post(url, json=body, headers=headers) as resp:
+        async with _limit(self.limiter, url), self.session.post(
+            url, json=body, headers=headers
+        ) as resp:
             data = await resp.json()
-        courses = [Course(**d) for d in data[0]["data"]["courses"]]
+        if not isinstance(data, list):
+            raise SessionExpired(f"Could not list courses: {data}")
+        return [Course(**d) for d in data[0]["data"]["courses"]]
+
+    async def attendance(self) -> list[Attendance]:
+        """The attendance module of every enrolled course that has one"""
+        with stage("lms.enumerate"):
+            courses = await self.courses()
+            modules = await self.attendance_modules(courses)
+        return [
+            Attendance(course.fullnamedisplay, modules[course.id])
+            for course in courses
+            if course.id in modules
+        ]
+
+    async def get_reports(self, modules: list[Attendance]) -> list[Report]:
         tasks: list[asyncio.Task[Report | None]] = []
-        for course in courses:
-            task = asyncio.create_task(self.get_course_attendance(course))
+        for name, module in modules:
+            task = asyncio.create_task(
+                Report.fetch(
+                    module, name=name, session=self.session, limiter=self.limiter
+                )
+            )
             tasks.append(task)
         return list(filter(None, await asyncio.gather(*tasks)))
 
-    async def get_course_attendance(self, course: Course) -> Report | None:
-        body = [
-            {
-                "index": 0,
-                "methodname": "core_courseformat_get_state",
-                "args": {"courseid": course.id},
-            }
+    async def stream_reports(self, modules: list[Attendance]) -> AsyncIterator[Report]:
+        """Yields reports as their pages come in, rather than in course order"""
+        tasks = [
+            asyncio.create_task(
+                Report.fetch(
+                    module, name=name, session=self.session, limiter=self.limiter
+                )
+            )
+            for name, module in modules
         ]
+        try:
+            for done in asyncio.as_completed(tasks):
+                if (report := await done) is not None:
+                    yield report
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def attendance_modules(self, courses: list[Course]) -> dict[int, str]:
+        """Maps course ids to their attendance module, a batch of courses per call.
+
+        Moodle stops at the first failing call of a batch, so the calls after
+        it are sent again with the next batch.
+        """
         url = (
             BASE_URL
             / "lib/ajax/service.php"
             % {"sesskey": self.session_key, "info": "core_courseformat_get_state"}
         )
-        async with self.session.post(url, json=body) as resp:
-            data = await resp.json()
-            cpm = CoursePage(**json.loads(data[0]["data"]))
-        for item in cpm.cm:
-            if item.name == "Attendance":
-                return await Report.fetch(
-                    item.id, name=course.fullnamedisplay, session=self.session
-                )
+        modules: dict[int, str] = {}
+        pending = [course.id for course in courses]
+        while pending:
+            batch, pending = pending[:STATE_BATCH], pending[STATE_BATCH:]
+            body = [
+                {
+                    "index": i,
+                    "methodname": "core_courseformat_get_state",
+                    "args": {"courseid": course_id},
+                }
+                for i, course_id in enumerate(batch)
+            ]
+            async with _limit(self.limiter, url), self.session.post(
+                url, json=body
+            ) as resp:
+                data = await resp.json()
+            if not isinstance(data, list) or not data:
+                raise SessionExpired(f"Could not look up courses: {data}")
+            for course_id, result in zip(batch, data):
+                # most courses have no attendance module; skip decoding those
+                if result.get("error") or "Attendance" not in result["data"]:
+                    continue
+                cpm = CoursePage(**json.loads(result["data"]))
+                for item in cpm.cm:
+                    if item.name == "Attendance":
+                        modules[course_id] = item.id
+                        break
+            pending = batch[len(data) :] + pending
+        return modules
+
+    async def get_course_attendance(self, course: Course) -> Report | None:
+        modules = await self.attendance_modules([course])
+        if (module := modules.get(course.id)) is not None:
+            return await Report.fetch(
+                module,
+                name=course.fullnamedisplay,
+                session=self.session,
+                limiter=self.limiter,
+            )
 
 
 class Report(BaseModel):
@@ -177,24 +330,28 @@ class Report(BaseModel):
 
     @classmethod
     async def fetch(
-        cls, _id: str, *, name: str, session: ClientSession
+        cls, _id: str, *, name: str, session: ClientSession, limiter: Limiter = None
     ) -> Report | None:
         url = BASE_URL / "mod/attendance/view.php" % {"id": _id, "view": "5"}
-        async with session.get(url) as resp:
-            text = await resp.text()
+        with stage("lms.scrape"):
+            async with _limit(limiter, url), session.get(url) as resp:
+                if resp.url.path.endswith("/login/index.php"):
+                    raise SessionExpired(f"Redirected to login from {url}")
+                text = await resp.text()
+            with stage("lms.parse"):
+                return await asyncio.to_thread(cls.parse, text, name=name)
 
-        def _thread():
-            soup = BeautifulSoup(text, "html.parser")
-            if data := soup.select_one(".attlist > tbody:nth-child(1)"):
-                tds = data.select("td")
-                seq = list(cls.model_fields.keys())[1:]
-                pack = {}
-                for item, i in zip(seq, range(1, len(tds), 2)):
-                    pack[item] = tds[i].text
-                pack["name"] = name
-                return cls(**pack)
-
-        return await asyncio.to_thread(_thread)
+    @classmethod
+    def parse(cls, text: str, *, name: str) -> Report | None:
+        soup = BeautifulSoup(text, HTML_PARSER, parse_only=ATTENDANCE_TABLE)
+        if data := soup.select_one(".attlist > tbody:nth-child(1)"):
+            tds = data.select("td")
+            seq = list(cls.model_fields.keys())[1:]
+            pack = {}
+            for item, i in zip(seq, range(1, len(tds), 2)):
+                pack[item] = tds[i].text
+            pack["name"] = name
+            return cls(**pack)
 
     def __str__(self) -> str:
         rows: list[tuple[str, str]] = []
@@ -203,8 +360,12 @@ class Report(BaseModel):
             rows.append((clean, getattr(self, item, "-")))
         return "\n".join([f"{header}: {item}" for header, item in rows])
 
-    def get_fields(self):
-        return [item.replace("_", " ").title() for item in self.model_fields]
+    @classmethod
+    def get_fields(cls):
+        return [item.replace("_", " ").title() for item in cls.model_fields]
+
+    def as_row(self) -> list[str]:
+        return [getattr(self, i, "-") for i in self.model_fields]
 
     def as_html(self) -> str:
         return (
@@ -212,3 +373,142 @@ class Report(BaseModel):
             + "".join(f"<td>{getattr(self, i, '-')}</td>" for i in self.model_fields)
             + "</tr>"
         )
+
+
+class MoodleUser:
+    """What is remembered about one student between visits; never the password"""
+
+    __slots__ = (
+        "salt",
+        "verifier",
+        "cookie_jar",
+        "session_key",
+        "used_at",
+        "modules",
+        "modules_at",
+        "reports",
+        "reported_at",
+    )
+
+    def __init__(self, salt: bytes, verifier: bytes):
+        self.salt = salt
+        self.verifier = verifier
+        self.cookie_jar = CookieJar()
+        self.session_key: str | None = None
+        self.used_at = 0.0
+        self.modules: list[Attendance] | None = None
+        self.modules_at = float("-inf")
+        self.reports: list[Report] = []
+        self.reported_at = float("-inf")
+
+
+class MoodleCache:
+    """Per-student Moodle sessions, attendance modules and reports.
+
+    Students are keyed by a salted hash of their PRN and must present the
+    password whose (salted, stretched) hash was stored at their last login
+    before anything cached is used. A live session is reused until it has
+    been idle for `session_ttl`; the attendance module of each course is
+    kept for the term (`term_ttl`) and rendered reports for `report_ttl`.
+    """
+
+    iterations = 100_000
+
+    def __init__(
+        self,
+        pool: MoodlePool,
+        *,
+        report_ttl: float = 300,
+        session_ttl: float = 1800,
+        term_ttl: float = 7 * 86400,
+        maxsize: int = 1024,
+    ):
+        self.pool = pool
+        self.report_ttl = report_ttl
+        self.session_ttl = session_ttl
+        self.term_ttl = term_ttl
+        self._salt = os.urandom(16)
+        self._users: TTLCache[bytes, MoodleUser] = TTLCache(
+            ttl=term_ttl, maxsize=maxsize
+        )
+
+    def _key(self, prn: str) -> bytes:
+        return hashlib.blake2b(prn.encode(), key=self._salt, digest_size=16).digest()
+
+    async def _stretch(self, password: str, salt: bytes) -> bytes:
+        return await asyncio.to_thread(
+            hashlib.pbkdf2_hmac, "sha256", password.encode(), salt, self.iterations
+        )
+
+    async def _verified(self, key: bytes, password: str) -> MoodleUser | None:
+        if (user := self._users.get(key)) is None:
+            return None
+        if hmac.compare_digest(user.verifier, await self._stretch(password, user.salt)):
+            return user
+        return None
+
+    async def reports(self, *, prn: str, password: str) -> list[Report]:
+        reports = [r async for r in self.stream(prn=prn, password=password)]
+        return sorted(reports, key=lambda r: r.name.casefold())
+
+    async def stream(self, *, prn: str, password: str) -> AsyncIterator[Report]:
+        key = self._key(prn)
+        sent: set[str] = set()
+        if (user := await self._verified(key, password)) is not None:
+            fresh_reports = time.monotonic() - user.reported_at < self.report_ttl
+            cache_lookup("moodle.reports", fresh_reports)
+            if fresh_reports:
+                for report in user.reports:
+                    yield report
+                return
+            live = (
+                user.session_key is not None
+                and user.modules is not None
+                and time.monotonic() - user.used_at < self.session_ttl
+            )
+            cache_lookup("moodle.session", live)
+            if live:
+                try:
+                    async for report in self._stream(user):
+                        sent.add(report.name)
+                        yield report
+                    return
+                except SessionExpired:
+                    pass
+            fresh = MoodleUser(user.salt, user.verifier)
+            if time.monotonic() - user.modules_at < self.term_ttl:
+                fresh.modules, fresh.modules_at = user.modules, user.modules_at
+        else:
+            cache_lookup("moodle.reports", False)
+            salt = os.urandom(16)
+            fresh = MoodleUser(salt, await self._stretch(password, salt))
+        async with self.pool.session(fresh.cookie_jar) as session:
+            moodle = await Moodle.init(
+                prn=prn, password=password, session=session, limiter=self.pool.limiter
+            )
+        fresh.session_key = moodle.session_key
+        self._users.set(key, fresh)
+        async for report in self._stream(fresh):
+            if report.name not in sent:
+                yield report
+
+    async def _stream(self, user: MoodleUser) -> AsyncIterator[Report]:
+        assert user.session_key is not None
+        reports: list[Report] = []
+        async with self.pool.session(user.cookie_jar) as session:
+            moodle = Moodle(
+                user.session_key, session=session, limiter=self.pool.limiter
+            )
+            cache_lookup("moodle.modules", user.modules is not None)
+            if user.modules is None:
+                user.modules = await moodle.attendance()
+                user.modules_at = time.monotonic()
+            try:
+                async for report in moodle.stream_reports(user.modules):
+                    reports.append(report)
+                    yield report
+            except SessionExpired:
+                user.session_key = None
+                raise
+        user.used_at = user.reported_at = time.monotonic()
+        user.reports = sorted(reports, key=lambda r: r.name.casefold())
@@ -0,0 +1,183 @@
+from __future__ import annotations
+import time
+from bisect import bisect_left
+from typing import Iterator
+from aiohttp import TraceConfig, TraceRequestEndParams, TraceRequestExceptionParams
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = tuple[str, ...]
+
+REGISTRY: list[Metric] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Labels = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Labels = ()):
+        super().__init__(name, doc, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; counts are kept per bucket and summed on render"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = BUCKETS,
+    ):
+        super().__init__(name, doc, labelnames)
+        self.buckets = buckets
+        self._series: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        if (series := self._series.get(labels)) is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def time(self, *labels: str) -> Timer:
+        return Timer(self, labels)
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total[0]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> Timer:
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+STAGE_SECONDS = Histogram(
+    "chronicler_stage_seconds", "Time spent in each stage of a request", ("stage",)
+)
+CACHE_LOOKUPS = Counter(
+    "chronicler_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ("cache", "result"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "chronicler_upstream_requests_total",
+    "Requests made to upstream services by status",
+    ("upstream", "status"),
+)
+UPSTREAM_COALESCED = Counter(
+    "chronicler_upstream_coalesced_total",
+    "Upstream range requests saved by merging them into another request",
+    ("upstream",),
+)
+CIRCUIT_REJECTIONS = Counter(
+    "chronicler_circuit_rejections_total",
+    "Upstream calls refused because the upstream's circuit was open",
+    ("upstream",),
+)
+QUERY_PLANS = Counter(
+    "chronicler_query_plans_total",
+    "Queries by whether their filters were pushed down to the upstream",
+    ("query", "plan"),
+)
+
+
+def stage(name: str) -> Timer:
+    return STAGE_SECONDS.time(name)
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache, "hit" if hit else "miss")
+
+
+def upstream_trace(upstream: str) -> TraceConfig:
+    """Counts every request an aiohttp session sends, by response status"""
+    trace = TraceConfig()
+
+    async def on_end(session, context, params: TraceRequestEndParams):
+        UPSTREAM_REQUESTS.inc(upstream, str(params.response.status))
+
+    async def on_exception(session, context, params: TraceRequestExceptionParams):
+        UPSTREAM_REQUESTS.inc(upstream, "error")
+
+    trace.on_request_end.append(on_end)
+    trace.on_request_exception.append(on_exception)
+    return trace
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import re
+from collections import Counter
+from datetime import date
+from typing import Iterable, NamedTuple
+
+from .core import Record, TimetableClient
+from .metrics import QUERY_PLANS
+
+# anything that makes a filter more than a plain substring
+REGEX_SYNTAX = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+class Plan(NamedTuple):
+    """Filters to send to report.php along with a range"""
+
+    typematch: tuple[str, ...] = ()
+    roommatch: str = ""
+    descrmatch: str = ""
+
+
+def parse_type_codes(raw: str) -> dict[str, str]:
+    """Parses `A=Lecture,B=Practical` into a type name: MRBS type code mapping"""
+    codes: dict[str, str] = {}
+    for pair in raw.split(","):
+        code, sep, name = pair.partition("=")
+        if sep and code.strip() and name.strip():
+            codes[name.strip()] = code.strip()
+    return codes
+
+
+def _share(counts: Counter[str], matches: Iterable[str]) -> float | None:
+    if not (total := counts.total()):
+        return None
+    return sum(counts[key] for key in matches) / total
+
+
+class Planner:
+    """Decides whether a query's filters are worth pushing down to report.php.
+
+    A filtered report only transfers and parses the matching rows, but is
+    cached for that one query, while a full fetch fills the day segments
+    every other query is answered from. Filters are pushed down only when
+    the range isn't cached yet and the filtered report is estimated, from
+    the catalogue's booking counts, to be at most `ratio` the size of the
+    days a full fetch would download.
+
+    Upstream matching is looser than ours (types by code, rooms and
+    descriptions by substring), so results must still be filtered locally.
+    """
+
+    def __init__(
+        self,
+        client: TimetableClient,
+        *,
+        type_codes: dict[str, str] = {},
+        ratio: float = 0.5,
+    ):
+        self.client = client
+        self.type_codes = type_codes
+        self.ratio = ratio
+
+    def _worth_it(self, start: date, end: date, share: float | None) -> bool:
+        if share is None or self.ratio <= 0:
+            return False
+        if not (missing := self.client.missing_days(start, end)):
+            return False
+        days = (end - start).days + 1
+        return days * share <= len(missing) * self.ratio
+
+    def table(self, start: date, end: date, types: dict[str, list[str]]) -> Plan | None:
+        plan = self._table(start, end, types)
+        QUERY_PLANS.inc("table", "full" if plan is None else "pushdown")
+        return plan
+
+    def _table(
+        self, start: date, end: date, types: dict[str, list[str]]
+    ) -> Plan | None:
+        if not types or not all(t in self.type_codes for t in types):
+            return None
+        if not self._worth_it(start, end, _share(self.client.type_counts, types)):
+            return None
+        # MRBS has a single description filter for every type, so only a
+        # substring all the selected types are filtered by can go with them
+        filters = {tuple(f) for f in types.values()}
+        descrmatch = ""
+        if len(filters) == 1 and len(only := filters.pop()) == 1:
+            if not REGEX_SYNTAX.search(only[0]):
+                descrmatch = only[0]
+        return Plan(
+            typematch=tuple(sorted(self.type_codes[t] for t in types)),
+            descrmatch=descrmatch,
+        )
+
+    def rooms(self, day: date, room: str) -> Plan | None:
+        plan = self._rooms(day, room)
+        QUERY_PLANS.inc("fc", "full" if plan is None else "pushdown")
+        return plan
+
+    def _rooms(self, day: date, room: str) -> Plan | None:
+        if room == "All" or not room:
+            return None
+        counts = self.client.room_counts
+        needle = room.casefold()
+        share = _share(counts, (r for r in counts if needle in r.casefold()))
+        if not self._worth_it(day, day, share):
+            return None
+        return Plan(roommatch=room)
+
+    async def records(self, start: date, end: date, plan: Plan | None) -> list[Record]:
+        if plan is None:
+            return await self.client.records(start, end)
+        return await self.client.fetch_records(
+            start,
+            end,
+            typematch=list(plan.typematch),
+            roommatch=plan.roommatch,
+            descrmatch=plan.descrmatch,
+        )
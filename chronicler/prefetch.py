@@ -0,0 +1,60 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+from .core import TimetableClient
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Keeps the next `days` days and the type/room catalogues warm in a TimetableClient."""
+
+    def __init__(
+        self,
+        client: TimetableClient,
+        *,
+        interval: float = 240,
+        days: int = 7,
+        jitter: float = 30,
+    ):
+        self.client = client
+        self.interval = interval
+        self.days = days
+        self.jitter = jitter
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def tick(self):
+        self.client.prune()
+        start = datetime.now().date()
+        # days another worker refreshed since our last tick are shared, not refetched
+        await self.client.refresh(
+            start, start + timedelta(days=self.days - 1), max_age=self.interval
+        )
+        await self.client.refresh_catalogues()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Timetable prefetch failed")
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
@@ -0,0 +1,69 @@
+from __future__ import annotations
+import hashlib
+from typing import Callable, Hashable, NamedTuple
+from litestar import Request, Response
+from litestar.enums import MediaType
+from litestar.status_codes import HTTP_201_CREATED, HTTP_304_NOT_MODIFIED
+from pydantic import BaseModel
+
+from .cache import TTLCache
+from .metrics import cache_lookup, stage
+
+
+class Encoded(NamedTuple):
+    body: bytes  # a JSON object
+    etag: str
+
+
+class ResponseCache:
+    """Encoded JSON bodies keyed on everything that went into building them.
+
+    Keys include the versions of the day segments a response was built
+    from, so refreshing a day stops its old responses from being served.
+    Bodies hold nothing specific to the request that built them, so a
+    rebuild of the same data gets the same ETag.
+    """
+
+    def __init__(self, *, ttl: float, maxsize: int):
+        self._cache: TTLCache[Hashable, Encoded] = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], BaseModel]) -> Encoded:
+        encoded = self._cache.get(key)
+        cache_lookup("response", encoded is not None)
+        if encoded is None:
+            model = build()
+            with stage("response.encode"):
+                body = model.model_dump_json().encode()
+            encoded = Encoded(
+                body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+            )
+            self._cache.set(key, encoded)
+        return encoded
+
+
+def respond(
+    request: Request,
+    encoded: Encoded,
+    *,
+    status_code: int = HTTP_201_CREATED,
+    age: float = 0,
+    elapsed: float | None = None,
+) -> Response[bytes]:
+    """`age` is how old the data behind the response is, sent as an `Age` header.
+
+    `elapsed` is how long this request took. It goes into the body as its
+    `time` field on the way out, leaving the cached body and ETag alone.
+    """
+    headers = {"ETag": encoded.etag, "Age": str(int(age))}
+    if request.headers.get("If-None-Match") == encoded.etag:
+        return Response(b"", status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+    body = encoded.body
+    if elapsed is not None:
+        rest = body[1:]
+        body = b'{"time":%r%s' % (elapsed, rest if rest == b"}" else b"," + rest)
+    return Response(
+        body,
+        status_code=status_code,
+        media_type=MediaType.JSON,
+        headers=headers,
+    )
@@ -0,0 +1,70 @@
+from __future__ import annotations
+from bisect import bisect_right
+from datetime import datetime, time
+from typing import Iterable, Protocol
+
+OPENS = time(7, 30)
+CLOSES = time(20, 30)
+
+Window = tuple[str, str]
+
+
+class Booking(Protocol):
+    room: str
+    start: datetime
+    end: datetime
+
+
+def minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def hhmm(m: int) -> str:
+    return f"{m // 60:02}:{m % 60:02}"
+
+
+class RoomIndex:
+    """Free windows of every booked room on one day, as sorted minute-of-day arrays.
+
+    Built once per day segment; lookups are bisects over a room's windows.
+    """
+
+    def __init__(self, bookings: Iterable[Booking]):
+        busy: dict[str, list[tuple[int, int]]] = {}
+        for b in bookings:
+            busy.setdefault(b.room, []).append(
+                (minutes(b.start.time()), minutes(b.end.time()))
+            )
+        self._starts: dict[str, list[int]] = {}
+        self._ends: dict[str, list[int]] = {}
+        for room, intervals in busy.items():
+            starts: list[int] = []
+            ends: list[int] = []
+            cursor, closes = minutes(OPENS), minutes(CLOSES)
+            for start, end in sorted(intervals):
+                if min(start, closes) > cursor:
+                    starts.append(cursor)
+                    ends.append(min(start, closes))
+                cursor = max(cursor, end)
+            if cursor < closes:
+                starts.append(cursor)
+                ends.append(closes)
+            self._starts[room] = starts
+            self._ends[room] = ends
+        self.rooms = sorted(busy)
+
+    def __contains__(self, room: str) -> bool:
+        return room in self._starts
+
+    def windows(self, room: str) -> list[Window]:
+        return [
+            (hhmm(s), hhmm(e)) for s, e in zip(self._starts[room], self._ends[room])
+        ]
+
+    def window_at(self, room: str, at: time) -> Window | None:
+        m = minutes(at)
+        starts = self._starts[room]
+        i = bisect_right(starts, m) - 1
+        if i >= 0 and m <= self._ends[room][i]:
+            return hhmm(starts[i]), hhmm(self._ends[room][i])
+        return None
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import re
+from datetime import date, datetime, time
+from typing import Generic, Iterable, Iterator, Protocol, TypeVar
+
+WORD = re.compile(r"\w+")
+
+
+class Searchable(Protocol):
+    brief_desc: str
+    room: str
+    start: datetime
+    end: datetime
+    full_desc: str
+    type: str
+    creator: str
+
+
+T = TypeVar("T", bound=Searchable)
+
+
+def words(text: str) -> set[str]:
+    return set(WORD.findall(text.casefold()))
+
+
+def keys(item: Searchable) -> set[str]:
+    """Posting keys of a booking: its words, and its room, type and creator as a whole"""
+    found = words(item.full_desc) | words(item.brief_desc) | words(item.room)
+    found |= words(item.type) | words(item.creator)
+    found.add("room:" + item.room.casefold())
+    found.add("type:" + item.type.casefold())
+    found.add("creator:" + item.creator.casefold())
+    return found
+
+
+class SearchIndex(Generic[T]):
+    """Inverted index over the bookings of every cached day.
+
+    Bookings get small integer ids, and each word or field value maps to
+    the set of ids it appears in. A day is reindexed as a whole whenever
+    its segment changes, and removed when the day cache drops it, so
+    lookups never need to scan the timetable.
+    """
+
+    def __init__(self):
+        self._items: dict[int, T] = {}
+        self._days: dict[date, list[int]] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._free: list[int] = []  # ids of removed bookings, reused first
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def replace(self, day: date, items: Iterable[T]):
+        """Swaps a day's bookings in the index for a new version of the day"""
+        for id_ in self._days.pop(day, []):
+            item = self._items.pop(id_)
+            for key in keys(item):
+                if (ids := self._postings.get(key)) is not None:
+                    ids.discard(id_)
+                    if not ids:
+                        del self._postings[key]
+            self._free.append(id_)
+        added: list[int] = []
+        for item in items:
+            if self._free:
+                id_ = self._free.pop()
+            else:
+                id_ = self._next
+                self._next += 1
+            self._items[id_] = item
+            for key in keys(item):
+                self._postings.setdefault(key, set()).add(id_)
+            added.append(id_)
+        if added:
+            self._days[day] = added
+
+    def remove(self, day: date):
+        self.replace(day, ())
+
+    def search(
+        self,
+        query: str = "",
+        *,
+        room: str = "",
+        type: str = "",
+        creator: str = "",
+        first: date | None = None,
+        last: date | None = None,
+        start: time | None = None,
+        end: time | None = None,
+    ) -> Iterator[T]:
+        """Bookings with every word of `query` and exactly the given room, type and creator.
+
+        Bookings can also be limited to a range of days and to those
+        overlapping the time of day between `start` and `end`.
+        """
+        wanted = sorted(words(query))
+        for field, value in (("room", room), ("type", type), ("creator", creator)):
+            if value:
+                wanted.append(f"{field}:{value.casefold()}")
+        if wanted:
+            postings = [self._postings.get(key, set()) for key in wanted]
+            postings.sort(key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+        else:
+            ids = set(self._items)
+
+        for id_ in ids:
+            item = self._items[id_]
+            day = item.start.date()
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            if start is not None and item.end.time() <= start:
+                continue
+            if end is not None and item.start.time() >= end:
+                continue
+            yield item
@@ -0,0 +1,400 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import NamedTuple
+from litestar.stores.base import StorageObject, Store
+from litestar.stores.file import FileStore
+from litestar.stores.memory import MemoryStore
+
+log = logging.getLogger(__name__)
+
+
+def _digest(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+    return hashlib.blake2b(value, digest_size=16).digest()
+
+
+class CountingStore(Store):
+    """Wraps the session store, keeping a count of its sessions as they come and go.
+
+    The count moves with the creates, deletes and expiries this process
+    sees. `sweep` deletes expired sessions and recounts what is left, which
+    also picks up sessions other workers created; `start` runs it every
+    `interval` seconds.
+
+    A session is written back on every response, almost always unchanged;
+    with `skip_unchanged` such writes are dropped. That relies on sessions
+    being read with `renew_for` (`renew_on_access`), which already extended
+    their expiry.
+    """
+
+    def __init__(
+        self, store: Store, *, interval: float = 600, skip_unchanged: bool = True
+    ):
+        self.store = store
+        self.interval = interval
+        self.skip_unchanged = skip_unchanged
+        self.count = 0
+        self._known: dict[str, bytes | None] = {}  # key: digest of its last value
+        self._task: asyncio.Task[None] | None = None
+
+    async def set(
+        self, key: str, value: str | bytes, expires_in: int | timedelta | None = None
+    ) -> None:
+        digest = _digest(value)
+        if key not in self._known:
+            if not await self.store.exists(key):
+                self.count += 1
+        elif self.skip_unchanged and self._known[key] == digest:
+            return
+        self._known[key] = digest
+        await self.store.set(key, value, expires_in)
+
+    async def get(
+        self, key: str, renew_for: int | timedelta | None = None
+    ) -> bytes | None:
+        value = await self.store.get(key, renew_for)
+        if value is None:
+            if self._known.pop(key, False) is not False:
+                # expired (and dropped by the store) or deleted by another worker
+                self.count = max(0, self.count - 1)
+        elif renew_for:
+            self._known[key] = _digest(value)
+        else:
+            self._known[key] = None  # known to exist, but not renewed
+        return value
+
+    async def delete(self, key: str) -> None:
+        if key in self._known or await self.store.exists(key):
+            self._known.pop(key, None)
+            self.count = max(0, self.count - 1)
+        await self.store.delete(key)
+
+    async def delete_all(self) -> None:
+        await self.store.delete_all()
+        self._known.clear()
+        self.count = 0
+
+    async def exists(self, key: str) -> bool:
+        return await self.store.exists(key)
+
+    async def expires_in(self, key: str) -> int | None:
+        return await self.store.expires_in(key)
+
+    async def open(self):
+        if isinstance(self.store, WriteBehindStore):
+            await self.store.open()
+        await self.recount()
+        self.start()
+
+    async def close(self):
+        await self.stop()
+        if isinstance(self.store, WriteBehindStore):
+            await self.store.close()
+
+    async def recount(self):
+        if isinstance(self.store, WriteBehindStore):
+            self.count = await self.store.size()
+        elif isinstance(self.store, FileStore):
+            self.count = await asyncio.to_thread(_count_files, str(self.store.path))
+        elif isinstance(self.store, MemoryStore):
+            self.count = len(self.store._store)
+        else:
+            return
+        self._known.clear()
+
+    async def sweep(self):
+        if (delete_expired := getattr(self.store, "delete_expired", None)) is not None:
+            await delete_expired()
+        await self.recount()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Session sweep failed")
+
+
+def _count_files(path: str) -> int:
+    try:
+        with os.scandir(path) as entries:
+            # skip FileStore's in-flight temporary files
+            return sum(1 for e in entries if ".tmp" not in e.name and e.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+class _Value(NamedTuple):
+    obj: StorageObject | None  # None: deleted
+    updated_at: float  # when the value was set, comparable between workers
+    renewal: bool = False  # only extends the expiry of the value set at updated_at
+    cached_at: float = 0  # when this worker last read or wrote it
+
+
+class WriteBehindStore(Store):
+    """Values in an in-memory LRU, persisted to a single SQLite file in the background.
+
+    Writes only touch memory; they are batched into one transaction every
+    `flush_interval` seconds and on `close`, so they survive restarts
+    without a request ever waiting on the disk. Reads fall through to the
+    file for values evicted from memory or held for over `cache_for`
+    seconds, so workers sharing the file see each other's flushed writes.
+
+    Rows carry the time their value was set, and a flush never replaces a
+    row with an older value: renewing a session only extends its expiry if
+    nobody has changed or deleted it since this worker read it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        maxsize: int = 10000,
+        flush_interval: float = 5,
+        cache_for: float = 1,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.cache_for = cache_for
+        self._memory: OrderedDict[str, _Value] = OrderedDict()
+        self._dirty: dict[str, _Value] = {}
+        self._db: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+
+    async def open(self):
+        self._db = await asyncio.to_thread(_connect, self.path)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._db is not None:
+            await self._execute(self._db.close)
+            self._db = None
+
+    async def _execute(self, fn, *args):
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def _remember(self, key: str, value: _Value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    async def _lookup(self, key: str) -> _Value | None:
+        value = self._memory.get(key)
+        if value is not None and (
+            key in self._dirty
+            or self._db is None
+            or time.monotonic() - value.cached_at < self.cache_for
+        ):
+            self._memory.move_to_end(key)
+            return value
+        if key in self._dirty:  # evicted from memory before it was flushed
+            return self._dirty[key]
+        if self._db is None:
+            return None
+        row = await self._execute(_select, self._db, key)
+        if key in self._dirty:  # set while we were reading
+            return self._dirty[key]
+        if row is None:
+            self._memory.pop(key, None)
+            return None
+        data, updated_at = row
+        value = _Value(
+            StorageObject.from_bytes(data), updated_at, False, time.monotonic()
+        )
+        self._remember(key, value)
+        return value
+
+    async def set(
+        self, key: str, value: str | bytes, expires_in: int | timedelta | None = None
+    ) -> None:
+        if isinstance(value, str):
+            value = value.encode()
+        obj = StorageObject.new(data=value, expires_in=expires_in)
+        written = _Value(obj, time.time(), False, time.monotonic())
+        self._remember(key, written)
+        self._dirty[key] = written
+
+    async def get(
+        self, key: str, renew_for: int | timedelta | None = None
+    ) -> bytes | None:
+        value = await self._lookup(key)
+        if value is None or value.obj is None or value.obj.expired:
+            # expired rows are left for `delete_expired`, as another worker
+            # may have renewed them since
+            return None
+        if renew_for and value.obj.expires_at:
+            pending = self._dirty.get(key)
+            renewed = value._replace(
+                obj=StorageObject.new(data=value.obj.data, expires_in=renew_for),
+                # renewing a value that isn't flushed yet still has to write it
+                renewal=pending is None or pending.renewal,
+            )
+            self._remember(key, renewed)
+            self._dirty[key] = renewed
+        return value.obj.data
+
+    async def delete(self, key: str) -> None:
+        self._memory.pop(key, None)
+        self._dirty[key] = _Value(None, time.time())
+
+    async def delete_all(self) -> None:
+        self._memory.clear()
+        self._dirty.clear()
+        if self._db is not None:
+            await self._execute(_delete_all, self._db)
+
+    async def exists(self, key: str) -> bool:
+        return await self.get(key) is not None
+
+    async def expires_in(self, key: str) -> int | None:
+        value = await self._lookup(key)
+        if value is None or value.obj is None or value.obj.expired:
+            return None
+        return value.obj.expires_in
+
+    async def delete_expired(self):
+        for key, value in list(self._memory.items()):
+            if value.obj is not None and value.obj.expired:
+                del self._memory[key]
+        await self.flush()
+        if self._db is not None:
+            await self._execute(_delete_expired, self._db)
+
+    async def size(self) -> int:
+        await self.flush()
+        if self._db is None:
+            return len(self._memory)
+        return await self._execute(_count, self._db)
+
+    async def flush(self):
+        if not self._dirty or self._db is None:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self._execute(_write, self._db, dirty)
+        except BaseException:
+            # keep whatever was written since, and retry the rest next time
+            self._dirty = {**dirty, **self._dirty}
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Could not write sessions to %s", self.path)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, expires_at REAL,"
+        " updated_at REAL NOT NULL DEFAULT 0, value BLOB NOT NULL)"
+    )
+    columns = {row[1] for row in db.execute("PRAGMA table_info(store)")}
+    if "updated_at" not in columns:  # written by an older version
+        db.execute("ALTER TABLE store ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+    db.commit()
+    return db
+
+
+def _select(db: sqlite3.Connection, key: str) -> tuple[bytes, float] | None:
+    return db.execute(
+        "SELECT value, updated_at FROM store WHERE key = ?", (key,)
+    ).fetchone()
+
+
+def _write(db: sqlite3.Connection, dirty: dict[str, _Value]):
+    def row(key: str, value: _Value) -> tuple:
+        assert value.obj is not None
+        expires_at = value.obj.expires_at and value.obj.expires_at.timestamp()
+        return (key, expires_at, value.updated_at, value.obj.to_bytes())
+
+    with db:
+        db.executemany(
+            "DELETE FROM store WHERE key = ? AND updated_at <= ?",
+            [(k, v.updated_at) for k, v in dirty.items() if v.obj is None],
+        )
+        db.executemany(
+            "INSERT INTO store (key, expires_at, updated_at, value) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at,"
+            " updated_at = excluded.updated_at, value = excluded.value"
+            " WHERE excluded.updated_at >= store.updated_at",
+            [
+                row(k, v)
+                for k, v in dirty.items()
+                if v.obj is not None and not v.renewal
+            ],
+        )
+        # a renewal must not bring back a deleted row, nor outlive a newer value
+        db.executemany(
+            "UPDATE store SET expires_at = ?, value = ? WHERE key = ? AND updated_at = ?",
+            [
+                (expires_at, data, key, updated_at)
+                for key, expires_at, updated_at, data in (
+                    row(k, v)
+                    for k, v in dirty.items()
+                    if v.obj is not None and v.renewal
+                )
+            ],
+        )
+
+
+def _delete_all(db: sqlite3.Connection):
+    with db:
+        db.execute("DELETE FROM store")
+
+
+def _delete_expired(db: sqlite3.Connection):
+    with db:
+        db.execute("DELETE FROM store WHERE expires_at <= ?", (time.time(),))
+
+
+def _count(db: sqlite3.Connection) -> int:
+    return db.execute(
+        "SELECT COUNT(*) FROM store WHERE expires_at IS NULL OR expires_at > ?",
+        (time.time(),),
+    ).fetchone()[0]
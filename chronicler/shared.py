@@ -0,0 +1,171 @@
+from __future__ import annotations
+import asyncio
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any
+from litestar.serialization import decode_json, encode_json
+from litestar.stores.base import Store
+from litestar.stores.file import FileStore
+
+from .core import Record, SegmentStore, StoredDay, days_between
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+DATETIME_FIELDS = {"start", "end", "last_updated"}
+# deletes a lock only if it is still the one this worker took
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _encode(record: Record) -> list[Any]:
+    values: list[Any] = []
+    for name, value in zip(Record.__slots__, record.astuple()):
+        if name in DATETIME_FIELDS:
+            value = value.isoformat()
+        elif name == "duration":
+            value = value.total_seconds()
+        values.append(value)
+    return values
+
+
+def _decode(values: list[Any]) -> Record:
+    decoded: list[Any] = []
+    for name, value in zip(Record.__slots__, values):
+        if name in DATETIME_FIELDS:
+            value = datetime.fromisoformat(value)
+        elif name == "duration":
+            value = timedelta(seconds=value)
+        decoded.append(value)
+    return Record.fromtuple(tuple(decoded))
+
+
+class LitestarSegmentStore(SegmentStore):
+    """Day segments kept in a Litestar `Store`, so every worker can share them.
+
+    Only stores outside the process, a `FileStore` or a `RedisStore`, are
+    shared between workers; a `MemoryStore` only serves one process.
+
+    Locks are taken with `SET NX` on `redis`, or by exclusively creating a
+    file in `lock_dir`; pass the client or directory the store itself
+    uses. Without either, locks only hold within this process. A lock
+    abandoned by a worker that died expires after `lock_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        *,
+        redis: Redis | None = None,
+        lock_dir: str | None = None,
+        retention: float = 86400,
+        lock_timeout: float = 30,
+    ):
+        self.store = store
+        self.redis = redis
+        self.lock_dir = lock_dir
+        self.retention = int(retention)
+        self.lock_timeout = lock_timeout
+        self._token = uuid.uuid4().hex
+        self._lock = asyncio.Lock()
+
+    async def init(self):
+        if isinstance(self.store, FileStore):
+            os.makedirs(self.store.path, exist_ok=True)
+        if self.lock_dir is not None:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    async def load(
+        self, start: date, end: date, *, max_age: float | None = None
+    ) -> dict[date, StoredDay]:
+        days: dict[date, StoredDay] = {}
+        for day in days_between(start, end):
+            if (raw := await self.store.get(f"day-{day.isoformat()}")) is None:
+                continue
+            data = decode_json(raw)
+            found = StoredDay(
+                data["fetched_at"],
+                data["fingerprint"],
+                [_decode(values) for values in data["records"]],
+            )
+            if max_age is None or found.age <= max_age:
+                days[day] = found
+        return days
+
+    async def save(self, segments: dict[date, tuple[str, list[Record]]]):
+        now = time.time()
+        for day, (fingerprint, records) in segments.items():
+            data = {
+                "fetched_at": now,
+                "fingerprint": fingerprint,
+                "records": [_encode(r) for r in records],
+            }
+            await self.store.set(
+                f"day-{day.isoformat()}", encode_json(data), expires_in=self.retention
+            )
+
+    async def acquire(self, day: date) -> bool:
+        key = f"lock-{day.isoformat()}"
+        expires = max(1, int(self.lock_timeout))
+        if self.redis is not None:
+            name = f"chronicler:{key}"
+            return bool(await self.redis.set(name, self._token, nx=True, ex=expires))
+        if self.lock_dir is not None:
+            path = os.path.join(self.lock_dir, key)
+            return await asyncio.to_thread(_lock_file, path, self._token, expires)
+        async with self._lock:
+            if await self.store.exists(key):
+                return False
+            await self.store.set(key, self._token, expires_in=expires)
+            return True
+
+    async def release(self, day: date):
+        key = f"lock-{day.isoformat()}"
+        if self.redis is not None:
+            await self.redis.eval(RELEASE_SCRIPT, 1, f"chronicler:{key}", self._token)
+        elif self.lock_dir is not None:
+            path = os.path.join(self.lock_dir, key)
+            await asyncio.to_thread(_unlock_file, path, self._token)
+        elif await self.store.get(key) == self._token.encode():
+            await self.store.delete(key)
+
+
+def _lock_file(path: str, token: str, expires: int) -> bool:
+    if _create_exclusive(path, token.encode()):
+        return True
+    try:
+        if os.path.getmtime(path) + expires > time.time():
+            return False
+        # abandoned; at worst two workers take it over at once and both fetch
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    return _create_exclusive(path, token.encode())
+
+
+def _unlock_file(path: str, token: str):
+    try:
+        with open(path, "rb") as f:
+            if f.read() != token.encode():
+                return
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _create_exclusive(path: str, data: bytes) -> bool:
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    return True
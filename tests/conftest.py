@@ -0,0 +1,34 @@
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+from typing import Callable
+
+import pytest
+
+from chronicler.core import Record
+
+Booking = Callable[..., Record]
+
+
+def _booking(day: date, hour: int, desc: str, room: str = "101 Lab") -> Record:
+    start = datetime.combine(day, time(hour))
+    return Record(
+        SimpleNamespace(
+            brief_desc="BCA SEM 2 DIV A",
+            area="SICSR",
+            room=room,
+            start=start,
+            end=start + timedelta(hours=1),
+            duration=timedelta(hours=1),
+            full_desc=desc,
+            type="Lecture",
+            creator="admin",
+            status="Confirmed",
+            last_updated=start,
+        )
+    )
+
+
+@pytest.fixture
+def booking() -> Booking:
+    """Builds an hour-long lecture `Record` starting at `hour` on `day`"""
+    return _booking
@@ -0,0 +1,30 @@
+import asyncio
+from datetime import date
+
+from chronicler.db import TimetableStore
+
+DAY = date(2024, 3, 4)
+
+
+async def _save_twice(url: str, booking):
+    store = TimetableStore(url)
+    await store.init()
+    try:
+        await store.save({DAY: ("v1", [booking(DAY, 9, "BCA-101 Databases")])})
+        again = [booking(DAY, 9, "BCA-101 Databases"), booking(DAY, 11, "Networks")]
+        await asyncio.gather(
+            store.save({DAY: ("v2", again)}), store.save({DAY: ("v2", again)})
+        )
+        return await store.load(DAY, DAY)
+    finally:
+        await store.close()
+
+
+def test_saving_a_day_again_replaces_it(tmp_path, booking):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}"
+    found = asyncio.run(_save_twice(url, booking))
+    assert found[DAY].fingerprint == "v2"
+    assert [r.full_desc for r in found[DAY].records] == [
+        "BCA-101 Databases",
+        "Networks",
+    ]
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+import pytest
+
+from chronicler import filters
+from chronicler.filters import FilterError, Matcher, compile_filters, filter_key
+
+
+def lecture(desc: str) -> SimpleNamespace:
+    return SimpleNamespace(type="Lecture", full_desc=desc)
+
+
+def test_the_match_budget_is_per_call(monkeypatch):
+    monkeypatch.setattr(filters, "MATCH_BUDGET", 0.005)
+    matcher = Matcher(filter_key({"Lecture": [r"\bBCA\b.*Prof\. [A-C]", r"Lab\s+\d+"]}))
+    for batch in range(50):  # far more than one budget's worth in all
+        items = [lecture(f"BCA-{batch} Course {i} - Prof. A") for i in range(100)]
+        assert len(matcher.select(items)) == 100
+    assert matcher.error is None
+
+
+def test_filters_that_time_out_stay_rejected():
+    types = {"Lecture": ["(a|a)+$"]}
+    matcher = compile_filters(types)
+    with pytest.raises(FilterError):
+        matcher.select([lecture("a" * 64 + "b")])
+    with pytest.raises(FilterError):
+        compile_filters(types)
@@ -0,0 +1,104 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+
+from chronicler.core import Entry, Record
+
+FORMAT = "%H:%M:%S - %A %d %B %Y"
+DURATIONS = [
+    "1 hours",
+    "2 hours",
+    "1.5 hours",
+    "0.75 hours",
+    "30 minutes",
+    "90 minutes",
+]
+
+
+def row(rng: random.Random) -> dict[str, str]:
+    start = datetime(2024, 1, 1, 8) + timedelta(
+        days=rng.randrange(366), minutes=30 * rng.randrange(24)
+    )
+    end = start + timedelta(minutes=30 * rng.randrange(1, 6))
+    return {
+        "Brief description": f"BCA SEM {rng.randint(1, 6)} DIV {rng.choice('ABC')}",
+        "Area": "SICSR",
+        "Room": rng.choice(["101 Lab", "003", "Seminar Hall"]),
+        "Start time": start.strftime(FORMAT),
+        "End time": end.strftime(FORMAT),
+        "Duration": rng.choice(DURATIONS),
+        "Full Description": f"BCA-{rng.randint(100, 140)} Course - Prof. {rng.choice('ABC')}",
+        "Type": rng.choice(["Lecture", "Practical", "Exam"]),
+        "Created by": "admin",
+        "Confirmation status": "Confirmed",
+        "Last updated": (start - timedelta(days=7)).strftime(FORMAT),
+    }
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_from_row_matches_validation(seed: int):
+    rng = random.Random(seed)
+    for _ in range(50):
+        data = row(rng)
+        assert (
+            Entry.from_row(data).model_dump() == Entry.model_validate(data).model_dump()
+        )
+
+
+@pytest.mark.parametrize("duration", DURATIONS)
+def test_fractional_durations(duration: str):
+    data = row(random.Random(duration))
+    data["Duration"] = duration
+    entry = Entry.from_row(data)
+    assert entry.duration == Entry.model_validate(data).duration
+    assert entry.model_dump() == Entry.model_validate(data).model_dump()
+
+
+def test_unusual_dates_fall_back_to_strptime():
+    data = row(random.Random(0))
+    data["Start time"] = "9:05:00 - Monday 1 January 2024"
+    assert Entry.from_row(data).model_dump() == Entry.model_validate(data).model_dump()
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("Start time", "tomorrow"),
+        ("End time", "25:00:00 - Monday 01 January 2024"),
+        ("Last updated", "10:00:00 - Monday 01 Brumaire 2024"),
+        ("Duration", "an hour"),
+        ("Duration", "1 fortnights"),
+    ],
+)
+def test_malformed_rows_raise_like_validation(field: str, value: str):
+    data = row(random.Random(field))
+    data[field] = value
+    with pytest.raises(Exception) as validated:
+        Entry.model_validate(data)
+    # an unknown unit gets past pydantic as a TypeError; either way, the same error
+    with pytest.raises(validated.type):
+        Entry.from_row(data)
+
+
+def test_missing_columns_raise_like_validation():
+    data = row(random.Random(1))
+    del data["Room"]
+    with pytest.raises(ValidationError):
+        Entry.from_row(data)
+
+
+def test_records_dump_like_entries():
+    rng = random.Random(1)
+    for _ in range(50):
+        entry = Entry.model_validate(row(rng))
+        dumped = Record(entry).dump()
+        assert dumped == {
+            "start": entry.start.strftime("%H:%M"),
+            "end": entry.end.strftime("%H:%M"),
+            "class": entry.full_desc,
+            "room": entry.room,
+            "duration": entry.duration.seconds // 60,
+        }
+        assert list(dumped) == Entry.dump_fields == list(entry.dump())
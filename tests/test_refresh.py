@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import time
+from datetime import date
+
+import pytest
+from aiohttp import ClientSession
+from yarl import URL
+
+from benchmarks.upstream import FakeReport
+from chronicler import core
+
+DAY = date(2024, 3, 4)
+
+
+async def _refresh_twice():
+    upstream = FakeReport(rooms=4, per_room=3)
+    url = await upstream.start()
+    base_url, core.BASE_URL = core.BASE_URL, url / "report.php"
+    try:
+        async with ClientSession() as session:
+            client = core.TimetableClient(session, cache_ttl=0.05)
+            first = await client.refresh(DAY, DAY)
+            await asyncio.sleep(0.1)  # the day is stale now, but still cached
+            assert client._days.get(DAY) is None
+            second = await client.refresh(DAY, DAY)
+            body = upstream.body(DAY, DAY, "", frozenset())
+            return first, second, body
+    finally:
+        core.BASE_URL = base_url
+        await upstream.stop()
+
+
+def test_stale_days_are_revalidated(monkeypatch):
+    answers: list[core.Snapshot | None] = []
+    download = core.download
+
+    async def recording(*args, **kwargs):
+        answers.append(await download(*args, **kwargs))
+        return answers[-1]
+
+    monkeypatch.setattr(core, "download", recording)
+    first, second, body = asyncio.run(_refresh_twice())
+    full, unchanged = answers
+    assert unchanged is None  # answered 304 to the validators of the first report
+    assert full is not None
+    assert full.validators.digest == hashlib.blake2b(body, digest_size=16).hexdigest()
+    assert sum(map(len, full.segments.values())) == 4 * 3
+    assert second[DAY] is first[DAY]
+
+
+async def _records_without_charset():
+    upstream = FakeReport(rooms=4, per_room=3, charset=None)
+    url = await upstream.start()
+    base_url, core.BASE_URL = core.BASE_URL, url / "report.php"
+    try:
+        async with ClientSession() as session:
+            return await core.TimetableClient(session).records(DAY, DAY)
+    finally:
+        core.BASE_URL = base_url
+        await upstream.stop()
+
+
+def test_reports_without_a_charset_are_read_as_utf8():
+    assert len(asyncio.run(_records_without_charset())) == 4 * 3
+
+
+class _OldStore(core.SegmentStore):
+    """Holds a day fetched long after its TTL, as left behind by a restart"""
+
+    def __init__(self, records: list[core.Record]):
+        self.records = records
+
+    async def load(self, start, end, *, max_age=None):
+        found = core.StoredDay(time.time() - 1000, "before", self.records)
+        if max_age is not None and found.age > max_age:
+            return {}
+        return {DAY: found} if start <= DAY <= end else {}
+
+    async def save(self, segments): ...
+
+    async def acquire(self, day):
+        return True
+
+    async def release(self, day): ...
+
+
+async def _records_while_down(booking, *, warm: bool):
+    base_url, core.BASE_URL = core.BASE_URL, URL("http://127.0.0.1:9/report.php")
+    try:
+        async with ClientSession() as session:
+            store = _OldStore([booking(DAY, 9, "Databases")])
+            client = core.TimetableClient(session, cache_ttl=300, store=store)
+            if warm:
+                await client.warm(DAY, DAY)
+            return await client.records(DAY, DAY)
+    finally:
+        core.BASE_URL = base_url
+
+
+@pytest.mark.parametrize("warm", [True, False])
+def test_stored_days_past_their_ttl_are_served_while_the_upstream_is_down(
+    booking, warm
+):
+    found = asyncio.run(_records_while_down(booking, warm=warm))
+    assert [r.full_desc for r in found] == ["Databases"]
@@ -0,0 +1,30 @@
+import json
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from chronicler.responses import ResponseCache, respond
+
+
+class Payload(BaseModel):
+    entries: dict[str, list[str]]
+
+
+def test_rebuilt_responses_keep_their_etag_and_report_their_own_time():
+    first = ResponseCache(ttl=60, maxsize=8).get_or_build(
+        "key", lambda: Payload(entries={"101": ["09:00"]})
+    )
+    rebuilt = ResponseCache(ttl=60, maxsize=8).get_or_build(
+        "key", lambda: Payload(entries={"101": ["09:00"]})
+    )
+    assert first == rebuilt
+
+    request = SimpleNamespace(headers={})
+    sent = json.loads(respond(request, first, elapsed=0.25).content)
+    assert sent == {"time": 0.25, "entries": {"101": ["09:00"]}}
+    assert json.loads(respond(request, first).content) == {
+        "entries": {"101": ["09:00"]}
+    }
+
+    request = SimpleNamespace(headers={"If-None-Match": first.etag})
+    assert respond(request, rebuilt, elapsed=0.5).status_code == 304
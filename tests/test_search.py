@@ -0,0 +1,70 @@
+import html
+import re
+from datetime import date, datetime, time, timedelta
+from urllib.parse import parse_qs
+
+from chronicler.core import Entry, Record, TimetableClient
+from chronicler.search import SearchIndex
+
+DAY = date(2024, 3, 4)
+
+
+def test_search_by_words_fields_and_time(booking):
+    index = SearchIndex[Record]()
+    index.replace(
+        DAY,
+        [
+            booking(DAY, 9, "BCA-101 Databases - Prof. A"),
+            booking(DAY, 11, "BCA-102 Networks - Prof. A", room="003"),
+        ],
+    )
+    assert [r.full_desc for r in index.search("databases prof")] == [
+        "BCA-101 Databases - Prof. A"
+    ]
+    assert len(list(index.search("prof", type="LECTURE"))) == 2
+    assert [r.room for r in index.search(room="003")] == ["003"]
+    assert [r.start.hour for r in index.search(start=time(10), end=time(12))] == [11]
+    assert not list(index.search("prof", first=DAY + timedelta(days=1)))
+
+
+def test_replacing_and_removing_days_leaves_no_postings(booking):
+    index = SearchIndex[Record]()
+    index.replace(DAY, [booking(DAY, 9, "Databases")])
+    index.replace(DAY, [booking(DAY, 9, "Networks")])
+    assert not list(index.search("databases"))
+    assert len(list(index.search("networks"))) == 1
+    index.remove(DAY)
+    assert len(index) == 0
+    assert not index._postings
+
+
+def test_days_evicted_from_the_cache_leave_the_index(booking):
+    index = SearchIndex[Record]()
+    client = TimetableClient(None, cache_days=2, index=index)  # type: ignore[arg-type]
+    days = [DAY + timedelta(days=i) for i in range(3)]
+    for day in days:
+        client._store_segment(day, [booking(day, 9, "Databases")])
+    assert sorted(r.start.date() for r in index.search("databases")) == days[1:]
+    assert days[0] not in client._fingerprints
+    assert days[0] not in client._versions
+
+
+def test_links_to_a_booking_find_it(booking):
+    index = SearchIndex[Record]()
+    for start, end in ((9, 0), (9, 45), (23, 30)):
+        record = booking(DAY, start, f"ends at {end}")
+        record.end = datetime.combine(DAY, time(start)) + timedelta(minutes=end or 60)
+        index.replace(DAY, [record])
+        entry = Entry.model_construct(
+            room=record.room, start=record.start, end=record.end
+        )
+        href = re.search(r'href="/search\?([^"]+)"', entry.url())
+        assert href is not None
+        query = {k: v[0] for k, v in parse_qs(html.unescape(href[1])).items()}
+        # as the /search handler reads its hours
+        found = index.search(
+            room=query["room"],
+            start=time(int(query["start"])),
+            end=None if query["end"] == "24" else time(int(query["end"])),
+        )
+        assert list(found) == [record]
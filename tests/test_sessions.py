@@ -0,0 +1,70 @@
+import asyncio
+
+from chronicler.sessions import WriteBehindStore
+
+
+async def _two_workers(path: str, scenario):
+    a = WriteBehindStore(path, cache_for=0.05)
+    b = WriteBehindStore(path, cache_for=0.05)
+    await a.open()
+    await b.open()
+    try:
+        return await scenario(a, b)
+    finally:
+        await a.close()
+        await b.close()
+
+
+def test_renewing_an_old_copy_keeps_the_newer_value(tmp_path):
+    async def scenario(a: WriteBehindStore, b: WriteBehindStore):
+        await a.set("session", b"anonymous", 3600)
+        await a.flush()
+        assert await b.get("session", renew_for=3600) == b"anonymous"
+        await b.set("session", b"logged in", 3600)
+        await b.flush()
+        # a still holds its copy, and renews it on the next request
+        assert await a.get("session", renew_for=3600) == b"anonymous"
+        await a.flush()
+        await asyncio.sleep(0.1)
+        return await a.get("session"), await b.get("session")
+
+    path = str(tmp_path / "sessions.db")
+    assert asyncio.run(_two_workers(path, scenario)) == (b"logged in", b"logged in")
+
+
+def test_renewing_does_not_bring_back_a_deleted_value(tmp_path):
+    async def scenario(a: WriteBehindStore, b: WriteBehindStore):
+        await a.set("session", b"logged in", 3600)
+        await a.flush()
+        assert await b.get("session") == b"logged in"
+        await b.delete("session")
+        await b.flush()
+        assert await a.get("session", renew_for=3600) == b"logged in"
+        await a.flush()
+        await asyncio.sleep(0.1)
+        return await a.get("session"), await a.size()
+
+    path = str(tmp_path / "sessions.db")
+    assert asyncio.run(_two_workers(path, scenario)) == (None, 0)
+
+
+def test_values_survive_a_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def write():
+        store = WriteBehindStore(path, maxsize=1)
+        await store.open()
+        await store.set("one", b"1", 3600)
+        await store.set("two", b"2", 3600)
+        await store.close()
+
+    async def read():
+        store = WriteBehindStore(path)
+        await store.open()
+        try:
+            return await store.get("one"), await store.get("two"), await store.size()
+        finally:
+            await store.close()
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == (b"1", b"2", 2)
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+from datetime import date
+
+from aiohttp import ClientSession
+from litestar.stores.file import FileStore
+
+from benchmarks.upstream import FakeReport
+from chronicler import core
+from chronicler.shared import LitestarSegmentStore
+
+START, END = date(2024, 3, 4), date(2024, 3, 10)
+
+
+async def _refresh_from_workers(path: str) -> tuple[int, int, list[int]]:
+    upstream = FakeReport(rooms=4, per_room=3, latency=0.05)
+    url = await upstream.start()
+    base_url, core.BASE_URL = core.BASE_URL, url / "report.php"
+    try:
+        async with ClientSession() as session:
+            workers = [
+                core.TimetableClient(
+                    session,
+                    store=LitestarSegmentStore(
+                        FileStore(f"{path}/cache"), lock_dir=f"{path}/locks"
+                    ),
+                )
+                for _ in range(4)
+            ]
+            for worker in workers:
+                await worker.store.init()
+            found = await asyncio.gather(
+                *(w.refresh(START, END, max_age=240) for w in workers)
+            )
+            first = upstream.days_served
+            await asyncio.gather(*(w.refresh(START, END, max_age=240) for w in workers))
+            await asyncio.sleep(0.1)  # let the lock releases finish
+            sizes = [sum(map(len, days.values())) for days in found]
+            return first, upstream.days_served - first, sizes
+    finally:
+        core.BASE_URL = base_url
+        await upstream.stop()
+
+
+def test_refresh_is_shared_between_workers(tmp_path):
+    first, second, sizes = asyncio.run(_refresh_from_workers(str(tmp_path)))
+    assert first == 7  # each day is downloaded by one worker, the others wait for it
+    assert second == 0  # and nobody refetches days refreshed since
+    assert sizes == [7 * 4 * 3] * 4
+
+
+async def _take_locks(path: str) -> list[bool]:
+    first, second = (
+        LitestarSegmentStore(FileStore(path), lock_dir=path, lock_timeout=1)
+        for _ in range(2)
+    )
+    taken = [await first.acquire(START), await second.acquire(START)]
+    await first.release(START)
+    taken.append(await second.acquire(START))
+    return taken
+
+
+def test_file_locks_are_exclusive_between_stores(tmp_path):
+    assert asyncio.run(_take_locks(str(tmp_path))) == [True, False, True]
+
+
+def test_abandoned_file_locks_expire(tmp_path):
+    async def take_over() -> bool:
+        dead = LitestarSegmentStore(FileStore(tmp_path), lock_dir=str(tmp_path))
+        assert await dead.acquire(START)
+        lock = tmp_path / f"lock-{START.isoformat()}"
+        os.utime(lock, (time.time() - 60, time.time() - 60))
+        alive = LitestarSegmentStore(FileStore(tmp_path), lock_dir=str(tmp_path))
+        return await alive.acquire(START)
+
+    assert asyncio.run(take_over())